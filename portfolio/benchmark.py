@@ -0,0 +1,225 @@
+"""Export benchmark on synthetic portfolios.
+
+Run against a development site, never production, with for example::
+
+    bench --site dev.localhost execute portfolio.benchmark.run --kwargs "{'sizes': [1, 10, 100]}"
+
+Synthetic Portfolio documents are inserted for each selection size, every
+(format, layout) combination is exported, and wall time, peak Python memory,
+query count and output size are reported per stage, followed by the stage
+breakdown recorded by the export's own metrics. Screenshots are served by a
+local stand-in HTTP server, so the numbers do not depend on the network. All
+synthetic records and export files are removed afterwards.
+"""
+
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import frappe
+from PIL import Image, ImageChops
+
+from portfolio.cache import clear_export_cache, get_cache_path, invalidate_portfolio_cache
+from portfolio.export import EXPORT_FORMATS, EXPORT_LAYOUTS, ExportProgress, build_export, iter_layout_html
+from portfolio.fetch import FAILED_URL_PREFIX
+from portfolio.loader import load_portfolios
+from portfolio.metrics import count_queries
+
+DEFAULT_SIZES = (1, 10, 100, 500)
+LOREM = (
+	"Spatial data infrastructure for catchment management, open source GIS training, "
+	"web mapping, field data collection and QGIS plugin development. "
+)
+
+
+def run(
+	sizes=DEFAULT_SIZES,
+	formats=EXPORT_FORMATS,
+	layouts=EXPORT_LAYOUTS,
+	technologies=5,
+	services=5,
+	images=3,
+	body_size=2000,
+	image_size=(1600, 1000),
+	cold=True,
+	output=None,
+):
+	"""Benchmark ``build_export`` and return one result per size, format, layout and stage.
+
+	With ``cold`` every export cache, including downloaded and downscaled images,
+	is cleared before every export, otherwise the caches warmed by earlier runs
+	are reused. Results
+	are printed as a table and, when ``output`` is given, written there as JSON.
+	"""
+	results = []
+	with image_server(image_size) as image_base_url:
+		for size in sizes:
+			names = make_portfolios(size, technologies, services, images, body_size, image_base_url)
+			try:
+				for format in formats:
+					for layout in layouts:
+						results.extend(benchmark_export(names, format, layout, cold=cold))
+			finally:
+				remove_portfolios(names)
+
+	print_results(results)
+	if output:
+		with open(output, "w") as f:
+			json.dump(results, f, indent=2)
+	return results
+
+
+def benchmark_export(names, format, layout, cold=True):
+	portfolio_names = json.dumps(names)
+	common = {"portfolios": len(names), "format": format, "layout": layout}
+
+	if cold:
+		clear_caches()
+	with measure("load") as load:
+		load_portfolios(names)
+	with measure("render") as render:
+		content = "".join(iter_layout_html(portfolio_names, layout))
+	render["output_bytes"] = len(content.encode())
+	del content
+
+	if cold:
+		clear_caches()
+	progress = ExportProgress(total=len(names))
+	with measure("export") as export:
+		file_doc = build_export(portfolio_names, format, layout, progress=progress)
+	export["output_bytes"] = file_doc.file_size or os.path.getsize(file_doc.get_full_path())
+	file_doc.delete(ignore_permissions=True)
+
+	export_stages = [
+		{
+			"stage": f"export.{stage}",
+			"seconds": values["seconds"],
+			"queries": values["queries"],
+			"output_bytes": values["bytes"],
+		}
+		for stage, values in progress.metrics.stages.items()
+	]
+	return [{**common, **stage} for stage in (load, render, export, *export_stages)]
+
+
+def clear_caches():
+	"""Drop every cache an export can hit, so a cold run does all of the work."""
+	clear_export_cache()
+	shutil.rmtree(get_cache_path("images", "remote"), ignore_errors=True)
+	shutil.rmtree(get_cache_path("images", "derived"), ignore_errors=True)
+	frappe.cache().delete_keys(f"{FAILED_URL_PREFIX}|")
+
+
+@contextmanager
+def measure(stage):
+	"""Record wall time, peak Python memory and query count of the enclosed block."""
+	result = {"stage": stage}
+	tracemalloc.start()
+	start = time.perf_counter()
+	with count_queries() as queries:
+		try:
+			yield result
+		finally:
+			result["seconds"] = round(time.perf_counter() - start, 3)
+			result["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+			result["queries"] = queries["count"]
+			tracemalloc.stop()
+
+
+def make_portfolios(count, technologies, services, images, body_size, image_base_url):
+	"""Insert ``count`` synthetic portfolios and return their names."""
+	run_id = frappe.generate_hash(length=6)
+	body = (LOREM * (body_size // len(LOREM) + 1))[:body_size]
+	names = []
+	for i in range(count):
+		doc = frappe.get_doc(
+			{
+				"doctype": "Portfolio",
+				"title": f"Benchmark Portfolio {run_id} {i}",
+				"client": f"Benchmark Client {i % 10}",
+				"location": random.choice(("South Africa", "Portugal", "Kenya", "Indonesia")),
+				"start_date": "2020-01-01",
+				"end_date": "2021-06-30",
+				"contact": "Benchmark Contact",
+				"client_reference": "Benchmark Reference",
+				"body": f'<p>{body}</p><img src="{image_base_url}/{run_id}/body/{i}.png">',
+				"technologies": [{"technology": f"Technology {t}"} for t in range(technologies)],
+				"services_listed": [{"service": f"Service {s}"} for s in range(services)],
+				"images": [
+					{"website_image": f"{image_base_url}/{run_id}/screenshot/{i}-{n}.png"}
+					for n in range(images)
+				],
+			}
+		)
+		doc.flags.ignore_links = True
+		doc.flags.ignore_mandatory = True
+		doc.insert(ignore_permissions=True)
+		names.append(doc.name)
+	return names
+
+
+def remove_portfolios(names):
+	for name in names:
+		invalidate_portfolio_cache(frappe._dict(name=name))
+		frappe.delete_doc("Portfolio", name, force=True, ignore_permissions=True)
+
+
+@contextmanager
+def image_server(image_size):
+	"""Serve a generated screenshot, different for every path, on a local port."""
+	noise = Image.effect_noise(tuple(image_size), 40).convert("RGB")
+
+	def get_image(path):
+		# Shifting the noise by an amount derived from the path gives every URL
+		# its own pixels, so no two images share a downscaled copy or bundle entry
+		seed = int(hashlib.sha1(path.encode()).hexdigest(), 16)
+		buffer = io.BytesIO()
+		ImageChops.offset(noise, seed % noise.width, seed // noise.width % noise.height).save(
+			buffer, "PNG", compress_level=1
+		)
+		return buffer.getvalue()
+
+	class ImageHandler(BaseHTTPRequestHandler):
+		def do_GET(self):
+			image = get_image(self.path)
+			self.send_response(200)
+			self.send_header("Content-Type", "image/png")
+			self.send_header("Content-Length", str(len(image)))
+			self.end_headers()
+			self.wfile.write(image)
+
+		def log_message(self, format, *args):
+			pass
+
+	server = ThreadingHTTPServer(("127.0.0.1", 0), ImageHandler)
+	thread = threading.Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	try:
+		yield f"http://127.0.0.1:{server.server_port}"
+	finally:
+		server.shutdown()
+		server.server_close()
+
+
+def print_results(results):
+	columns = (
+		"portfolios",
+		"format",
+		"layout",
+		"stage",
+		"seconds",
+		"peak_memory_bytes",
+		"queries",
+		"output_bytes",
+	)
+	print("  ".join(f"{column:>17}" for column in columns))
+	for result in results:
+		print("  ".join(f"{result.get(column, ''):>17}" for column in columns))
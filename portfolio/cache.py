@@ -0,0 +1,159 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+import frappe
+from frappe.utils import cint
+
+from portfolio.export_files import EXPORT_FINGERPRINT_PREFIX
+
+# Rendered per-portfolio fragments live in the Redis cache, which evicts the
+# least recently used keys once it reaches its memory limit. Keys embed the
+# document's ``modified`` timestamp, so an edited portfolio never hits a stale
+# fragment; the doc events below also drop its old entries straight away.
+FRAGMENT_CACHE_PREFIX = "portfolio_export_fragment"
+FRAGMENT_CACHE_TTL = 60 * 60 * 24 * 7
+
+# Rendered pages and downscaled images are kept on disk, where the least
+# recently used ones are evicted daily once the folders exceed their limits.
+# Sites can tune them with the `portfolio_page_cache_size` and
+# `portfolio_derived_image_cache_size` config keys (MB).
+DEFAULT_PAGE_CACHE_SIZE = 1000  # MB
+DEFAULT_DERIVED_IMAGE_CACHE_SIZE = 500  # MB
+
+
+def get_fragment_key(layout, variant, portfolio):
+	return f"{FRAGMENT_CACHE_PREFIX}|{portfolio.name}|{layout}|{variant}|{portfolio.modified}"
+
+
+def get_cached_fragment(layout, portfolio, render, variant="html"):
+	"""Return the cached rendering of ``portfolio``, calling ``render`` on a miss.
+
+	Renderings that embed absolute URLs pass the site URL as ``variant``, since
+	it differs between web requests and background jobs.
+	"""
+	key = get_fragment_key(layout, variant, portfolio)
+	fragment = frappe.cache().get_value(key)
+	if fragment is None:
+		fragment = render(portfolio)
+		frappe.cache().set_value(key, fragment, expires_in_sec=FRAGMENT_CACHE_TTL)
+	return fragment
+
+
+def get_cache_path(*parts):
+	"""Return a path in the site's private export cache folder."""
+	return frappe.get_site_path("private", "portfolio_cache", *parts)
+
+
+def get_page_cache_path(layout, variant, portfolio, private_urls=()):
+	"""Return where a rendered document (e.g. a PDF) of one portfolio revision is kept.
+
+	Pages are grouped in one folder per portfolio so they can all be dropped
+	together when it changes. Pages embed the ``private_urls`` the exporting
+	user can read, so users with different access never share a page.
+	"""
+	private = "|".join(sorted(private_urls))
+	revision = hashlib.sha1(f"{layout}|{variant}|{portfolio.modified}|{private}".encode()).hexdigest()
+	return get_cache_path("pages", get_name_hash(portfolio.name), f"{revision}.{variant}")
+
+
+def get_name_hash(name):
+	return hashlib.sha1(name.encode()).hexdigest()
+
+
+def read_cache_file(path):
+	try:
+		with open(path, "rb") as f:
+			return f.read()
+	except FileNotFoundError:
+		return None
+
+
+def write_cache_file(path, content):
+	"""Write ``content`` atomically, so concurrent readers never see a partial file.
+
+	Every write goes through its own temporary file, so threads and processes
+	may write the same path at once; the last one to finish wins.
+	"""
+	folder = os.path.dirname(path)
+	os.makedirs(folder, exist_ok=True)
+	fd, temp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+	try:
+		with os.fdopen(fd, "wb") as f:
+			f.write(content)
+		os.replace(temp_path, path)
+	except BaseException:
+		try:
+			os.remove(temp_path)
+		except FileNotFoundError:
+			pass
+		raise
+
+
+def touch_cache_file(path):
+	"""Mark a cached file as just used, returning whether it exists."""
+	try:
+		os.utime(path)
+		return True
+	except FileNotFoundError:
+		return False
+
+
+def get_cache_size(config_key, default):
+	"""Return the size limit, in bytes, a site sets for a cache folder (MB) or ``default``."""
+	return (cint(frappe.conf.get(config_key)) or default) * 1024 * 1024
+
+
+def evict_cache_files(folder, max_size):
+	"""Remove the least recently used files under ``folder`` until they fit in ``max_size`` bytes.
+
+	Readers touch the files they use, so modification times order them by last
+	use. Metadata kept next to a file as ``<file>.json`` is removed with it.
+	"""
+	entries = []
+	for root, _dirs, files in os.walk(folder):
+		for name in files:
+			if name.endswith((".json", ".tmp")):
+				continue
+			path = os.path.join(root, name)
+			try:
+				stat = os.stat(path)
+			except FileNotFoundError:
+				continue
+			entries.append((stat.st_mtime, stat.st_size, path))
+
+	size = sum(entry[1] for entry in entries)
+	for _mtime, entry_size, path in sorted(entries):
+		if size <= max_size:
+			break
+		for stale_path in (path, f"{path}.json"):
+			try:
+				os.remove(stale_path)
+			except FileNotFoundError:
+				pass
+		size -= entry_size
+
+
+def evict_export_cache():
+	"""Trim the rendered pages and downscaled images to their size limits (daily job)."""
+	evict_cache_files(
+		get_cache_path("pages"), get_cache_size("portfolio_page_cache_size", DEFAULT_PAGE_CACHE_SIZE)
+	)
+	evict_cache_files(
+		get_cache_path("images", "derived"),
+		get_cache_size("portfolio_derived_image_cache_size", DEFAULT_DERIVED_IMAGE_CACHE_SIZE),
+	)
+
+
+def clear_export_cache():
+	"""Drop all cached renderings and reusable exports, e.g. after a deploy changed the layout templates."""
+	frappe.cache().delete_keys(f"{FRAGMENT_CACHE_PREFIX}|")
+	frappe.cache().delete_keys(f"{EXPORT_FINGERPRINT_PREFIX}|")
+	shutil.rmtree(get_cache_path("pages"), ignore_errors=True)
+
+
+def invalidate_portfolio_cache(doc, method=None):
+	"""Drop every cached rendering of a Portfolio when it is saved or deleted."""
+	frappe.cache().delete_keys(f"{FRAGMENT_CACHE_PREFIX}|{doc.name}|")
+	shutil.rmtree(get_cache_path("pages", get_name_hash(doc.name)), ignore_errors=True)
@@ -2,422 +2,964 @@ import frappe
 from frappe.utils.pdf import get_pdf
 from frappe import _
 import io
-import requests
 from docx import Document
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.enum.table import WD_ALIGN_VERTICAL
-from bs4 import BeautifulSoup
+from docx.image.exceptions import UnrecognizedImageError
 from docx.shared import Inches, Pt
 from datetime import datetime
 import tempfile
+import time
 import os
 import re
-from html import unescape
 import zipfile
-from io import BytesIO
-import re
-from urllib.parse import urljoin
+import copy
+from functools import partial
+from docx.oxml.ns import qn
+from portfolio.image_processing import ImageProcessor
+from portfolio.images import ImageBundle, ImagePrefetcher, LocalAssetResolver, fetch_images, inline_local_images
+from portfolio.cache import (
+    get_cached_fragment,
+    get_page_cache_path,
+    touch_cache_file,
+    write_cache_file,
+)
+from portfolio.export_files import find_export_file, get_export_fingerprint, remember_export_file
+from portfolio.layouts import (
+    DOCX_LOGO_IMAGE,
+    DOCX_SCREENSHOT_IMAGE,
+    HTML_IMAGE,
+    PDF_IMAGE,
+    RenderContext,
+    get_image_urls,
+    get_kartoza_sheet,
+    get_worldbank_rows,
+)
+from portfolio.loader import SharedPortfolios, get_portfolio_names, iter_portfolio_chunks, iter_portfolios
+from portfolio.manifest import ExportManifest, get_previous_export
+from portfolio.metrics import ExportMetrics, get_recent_metrics, measure
+from portfolio.pdf import PdfRenderer, merge_pdfs
+
+EXPORT_FORMATS = ("pdf", "docx", "html")
+EXPORT_LAYOUTS = ("kartoza", "world bank")
+# "parallel" renders every portfolio to its own PDF concurrently and merges the
+# pages; "single" feeds the whole document to one wkhtmltopdf run.
+PDF_ENGINES = ("parallel", "single")
+
+FOOTER_IMAGE_PATTERN = re.compile(r'<img\b[^>]*\bclass="sheet-footer"[^>]*>')
+
+# Background exports run on the long queue and report progress to the user
+# who started them through realtime events and a short-lived status record.
+EXPORT_JOB_TIMEOUT = 60 * 60
+EXPORT_STATUS_TTL = 60 * 60 * 6
+EXPORT_PROGRESS_EVENT = "portfolio_export_progress"
+EXPORT_PROGRESS_INTERVAL = 0.5
+
 
 @frappe.whitelist()
-def export_portfolio(portfolio_names, format, layout):
+def export_portfolio(
+    portfolio_names=None,
+    format=None,
+    layout=None,
+    async_export=0,
+    pdf_engine="parallel",
+    previous_export=None,
+    filters=None,
+    order_by=None,
+    targets=None,
+):
+    """Export the selected portfolios, optionally building on an earlier export File.
+
+    With ``targets``, a list of ``[format, layout]`` pairs, the portfolios are
+    exported in each of them and returned together as one ZIP File.
+
+    Instead of a list of names, ``filters`` can be a Frappe filter spec (as used
+    by the list view) which is resolved here to every matching portfolio.
+
+    With ``previous_export``, portfolios unchanged since that export are copied
+    from its file and only edited or added ones are rendered again. Exporting the
+    same portfolio revisions again returns the File made the first time.
+    """
+    if filters:
+        portfolio_names = get_portfolio_names(filters, order_by)
+        if not portfolio_names:
+            frappe.throw(_("No portfolios match the filters"))
     if not portfolio_names:
         frappe.throw(_("No portfolio names provided"))
+    if targets:
+        targets = parse_export_targets(targets)
+        if len(targets) == 1:
+            (format, layout), targets = targets[0], None
+    if targets:
+        for target_format, target_layout in targets:
+            validate_export_options(target_format, target_layout, pdf_engine)
+        fingerprint = get_export_fingerprint(portfolio_names, "zip", None, pdf_engine=pdf_engine, targets=targets)
+    else:
+        validate_export_options(format, layout, pdf_engine)
+        fingerprint = get_export_fingerprint(portfolio_names, format, layout, pdf_engine=pdf_engine)
 
-    file_data_list = []
-    if layout == 'kartoza':
-        content = generate_kartoza_html_content(portfolio_names)
-    elif layout == 'world bank':
-        content = worldbank_format_html(portfolio_names)
-
-    if format == "pdf":
-        file_data = get_pdf(content)
-        file_extension = "pdf"
-    elif format == "docx":
-        file_data = generate_docx_from_html(content)
-        file_extension = "docx"
-    elif format == "html":
-        html_file_data = generate_html_file(content)
-        file_data_list.append((html_file_data, "html"))
-        file_extension = "zip"
-        # Create a ZIP file
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w') as zip_file:
-            timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            for file_data, ext in file_data_list:
-                file_name = f"portfolio_export_{timestamp}.{ext}"
-                zip_file.writestr(file_name, file_data)
-        zip_buffer.seek(0)
-        file_data = zip_buffer.getvalue()
+    # Background jobs would find it too, but there is no need to queue one
+    file_doc = find_export_file(fingerprint)
+    if file_doc:
+        return get_export_response(file_doc)
+
+    if frappe.utils.cint(async_export):
+        export_id = frappe.generate_hash(length=12)
+        total = len(frappe.parse_json(portfolio_names)) * len(targets or [None])
+        progress = ExportProgress(export_id, total=total)
+        progress.set_stage("queued")
+        frappe.enqueue(
+            "portfolio.export.run_export_job",
+            queue="long",
+            timeout=EXPORT_JOB_TIMEOUT,
+            export_id=export_id,
+            portfolio_names=portfolio_names,
+            format=format,
+            layout=layout,
+            pdf_engine=pdf_engine,
+            previous_export=previous_export,
+            targets=targets,
+        )
+        return {
+            "status": "queued",
+            "message": _("Portfolio export queued."),
+            "job_id": export_id,
+        }
+
+    if targets:
+        file_doc = build_multi_export(portfolio_names, targets, pdf_engine=pdf_engine)
     else:
+        file_doc = build_export(
+            portfolio_names, format, layout, pdf_engine=pdf_engine, previous_export=previous_export
+        )
+    return get_export_response(file_doc)
+
+
+def get_export_response(file_doc):
+    return {
+        "status": "success",
+        "message": f"Portfolios exported successfully.",
+        "file_url": file_doc.file_url,
+        "file_name": file_doc.name,
+    }
+
+
+@frappe.whitelist()
+def get_export_stats(limit=20):
+    """Return the metrics of the most recent exports on this site."""
+    frappe.only_for("System Manager")
+    return get_recent_metrics(frappe.utils.cint(limit) or 20)
+
+
+@frappe.whitelist()
+def get_export_status(job_id):
+    """Return the last recorded progress of a background export."""
+    status = frappe.cache().get_value(get_export_status_key(job_id))
+    if not status or status.get("user") != frappe.session.user:
+        return {"job_id": job_id, "status": "unknown"}
+    return status
+
+
+def run_export_job(
+    export_id, portfolio_names, format, layout, pdf_engine="parallel", previous_export=None, targets=None
+):
+    """Background job entry point for asynchronous exports."""
+    progress = ExportProgress(export_id, total=len(frappe.parse_json(portfolio_names)))
+    try:
+        if targets:
+            file_doc = build_multi_export(portfolio_names, targets, progress=progress, pdf_engine=pdf_engine)
+        else:
+            file_doc = build_export(
+                portfolio_names,
+                format,
+                layout,
+                progress=progress,
+                pdf_engine=pdf_engine,
+                previous_export=previous_export,
+            )
+    except Exception:
+        frappe.log_error(title=f"Portfolio export {export_id} failed")
+        progress.fail(_("Portfolio export failed. Please check the error log."))
+        raise
+    # The File must be visible to the browser before it is sent its URL
+    frappe.db.commit()
+    progress.complete(file_doc.file_url, file_doc.name)
+
+
+def validate_export_options(format, layout, pdf_engine="parallel"):
+    if format not in EXPORT_FORMATS:
         frappe.throw(_("Unsupported file format"))
+    if layout not in EXPORT_LAYOUTS:
+        frappe.throw(_("Unsupported layout"))
+    if pdf_engine not in PDF_ENGINES:
+        frappe.throw(_("Unsupported PDF engine"))
+
 
-    if format != "html":
-        file_data_list.append((file_data, file_extension))
+def build_export(portfolio_names, format, layout, progress=None, pdf_engine="parallel", previous_export=None):
+    """Render the selected portfolios and save the result as a private File.
+
+    A manifest of the exported portfolio revisions is kept for the File, so it
+    can be passed back as ``previous_export`` to only re-render what changed.
+    The File of an identical earlier export is returned as is.
+    """
+    validate_export_options(format, layout, pdf_engine)
+    fingerprint = get_export_fingerprint(portfolio_names, format, layout, pdf_engine=pdf_engine)
+    file_doc = find_export_file(fingerprint)
+    if file_doc:
+        return file_doc
+
+    previous = get_previous_export(previous_export, format, layout) if previous_export else None
+    progress = progress or ExportProgress()
+    context = {
+        "export_id": progress.export_id,
+        "user": progress.user,
+        "format": format,
+        "layout": layout,
+        "previous_export": previous_export,
+    }
+    with progress.metrics.track(progress.counters, **context):
+        manifest = ExportManifest(format, layout, pdf_engine)
+        file_doc = _build_export(portfolio_names, format, layout, progress, pdf_engine, manifest, previous)
+        manifest.save(file_doc.name)
+        remember_export_file(fingerprint, file_doc)
+        return file_doc
+
+
+def _build_export(portfolio_names, format, layout, progress, pdf_engine, manifest, previous=None):
+    # Every format is written straight to the site's private files, portfolio by
+    # portfolio, rather than built in memory and handed to the File document
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    file_name, path = get_export_file_path(get_target_file_name(timestamp, format))
+    write_export(portfolio_names, format, layout, path, progress, pdf_engine, manifest, previous)
+    progress.set_stage("saving")
+    with measure(progress, "save"):
+        return insert_export_file(file_name, path)
+
+
+def write_export(
+    portfolio_names,
+    format,
+    layout,
+    path,
+    progress,
+    pdf_engine="parallel",
+    manifest=None,
+    previous=None,
+    resolver=None,
+    portfolios=None,
+):
+    """Write the export of one format and layout to ``path``.
+
+    ``portfolios`` shares the loaded records with the other targets of a
+    multi-target export (see ``SharedPortfolios``).
+    """
+    manifest = manifest or ExportManifest(format, layout, pdf_engine)
+    context = RenderContext(layout, portfolios=portfolios)
+    resolver = resolver or LocalAssetResolver(context.base_url)
+    progress.set_stage("rendering")
+    try:
+        if format == "html":
+            with measure(progress, "zip"):
+                export_html_bundle(
+                    portfolio_names,
+                    layout,
+                    path,
+                    os.path.splitext(os.path.basename(path))[0] + ".html",
+                    manifest,
+                    previous=previous,
+                    progress=progress,
+                    resolver=resolver,
+                    context=context,
+                )
+        elif format == "docx":
+            # DOCX is built straight from the records, without rendering HTML first
+            if layout == 'kartoza':
+                generate_docx_content(
+                    portfolio_names,
+                    path,
+                    progress=progress,
+                    resolver=resolver,
+                    manifest=manifest,
+                    previous=previous,
+                    context=context,
+                )
+            elif layout == 'world bank':
+                worldbank_format(
+                    portfolio_names, path, progress=progress, manifest=manifest, previous=previous, context=context
+                )
+        elif pdf_engine == "parallel":
+            generate_pdf_per_portfolio(
+                portfolio_names,
+                layout,
+                resolver,
+                path,
+                progress=progress,
+                manifest=manifest,
+                previous=previous,
+                context=context,
+            )
+        else:
+            # One wkhtmltopdf run needs the whole document, and has no page
+            # boundaries per portfolio, so nothing is recorded to reuse
+            content = "".join(iter_layout_html(portfolio_names, layout, progress=progress, context=context))
+            progress.set_stage("building")
+            with measure(progress, "inline_images"):
+                content = inline_local_images(content, resolver, target=PDF_IMAGE)
+            with measure(progress, "pdf"):
+                file_data = get_pdf(content)
+            del content
+            with open(path, "wb") as f:
+                f.write(file_data)
+    except Exception:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    progress.metrics.add_bytes(format, os.path.getsize(path))
 
-        # Generate a default file name with timestamp
+
+def get_target_file_name(timestamp, format, layout=None):
+    extension = "zip" if format == "html" else format
+    layout = f"_{layout.replace(' ', '_')}" if layout else ""
+    return f"portfolio_export_{timestamp}{layout}.{extension}"
+
+
+def build_multi_export(portfolio_names, targets, progress=None, pdf_engine="parallel"):
+    """Export the selected portfolios in several formats and layouts, as one ZIP File.
+
+    ``targets`` is a list of ``(format, layout)`` pairs. The targets are written
+    one after another and share the export's records, resolver and the
+    fragment, body, page and image caches: each chunk of portfolios is loaded
+    once, and images and renderings fetched for the first target are reused by
+    the others.
+    """
+    targets = parse_export_targets(targets)
+    for format, layout in targets:
+        validate_export_options(format, layout, pdf_engine)
+    fingerprint = get_export_fingerprint(portfolio_names, "zip", None, pdf_engine=pdf_engine, targets=targets)
+    file_doc = find_export_file(fingerprint)
+    if file_doc:
+        return file_doc
+
+    progress = progress or ExportProgress()
+    progress.update(total=len(frappe.parse_json(portfolio_names)) * len(targets))
+    context = {"export_id": progress.export_id, "user": progress.user, "targets": targets}
+    with progress.metrics.track(progress.counters, **context):
         timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        default_file_name = f"portfolio_export_{timestamp}.{file_extension}"
+        file_name, path = get_export_file_path(get_target_file_name(timestamp, "zip"))
+        resolver = LocalAssetResolver()
+        portfolios = SharedPortfolios()
+        try:
+            with tempfile.TemporaryDirectory() as folder, zipfile.ZipFile(path, "w") as zip_file:
+                for format, layout in targets:
+                    target_name = get_target_file_name(timestamp, format, layout)
+                    target_path = os.path.join(folder, target_name)
+                    write_export(
+                        portfolio_names,
+                        format,
+                        layout,
+                        target_path,
+                        progress,
+                        pdf_engine,
+                        resolver=resolver,
+                        portfolios=portfolios,
+                    )
+                    # PDF, DOCX and HTML bundles are compressed already
+                    with measure(progress, "zip"):
+                        zip_file.write(target_path, target_name, compress_type=zipfile.ZIP_STORED)
+                    os.remove(target_path)
+        except Exception:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
 
-        # Create a new File document to save the generated file
-        file_doc = frappe.get_doc({
-            "doctype": "File",
-            "file_name": default_file_name,
-            "is_private": 1,
-            "content": file_data
-        })
-        file_doc.insert()
+        progress.set_stage("saving")
+        with measure(progress, "save"):
+            file_doc = insert_export_file(file_name, path)
+        remember_export_file(fingerprint, file_doc)
+        return file_doc
 
-        return {
-            "status": "success",
-            "message": f"Portfolios exported successfully.",
-            "file_url": file_doc.file_url
-        }
-    else:
-        # For HTML format, handle the ZIP file case
-        zip_file_name = f"portfolio_export_{timestamp}.zip"
-        file_doc = frappe.get_doc({
-            "doctype": "File",
-            "file_name": zip_file_name,
-            "is_private": 1,
-            "content": file_data
-        })
-        file_doc.insert()
 
-        return {
-            "status": "success",
-            "message": f"Portfolios exported successfully.",
-            "file_url": file_doc.file_url
+def parse_export_targets(targets):
+    """Return ``targets`` (``[format, layout]`` pairs or dicts) as distinct tuples."""
+    targets = [
+        (target["format"], target["layout"]) if isinstance(target, dict) else tuple(target)
+        for target in frappe.parse_json(targets)
+    ]
+    return list(dict.fromkeys(targets))
+
+
+def iter_layout_html(portfolio_names, layout, progress=None, context=None):
+    if layout == 'kartoza':
+        return iter_kartoza_html_content(portfolio_names, progress=progress, context=context)
+    elif layout == 'world bank':
+        return iter_worldbank_format_html(portfolio_names, progress=progress, context=context)
+
+
+def generate_pdf_per_portfolio(
+    portfolio_names, layout, resolver, output, progress=None, manifest=None, previous=None, context=None
+):
+    """Render every portfolio to its own PDF in parallel and merge them in order into ``output``.
+
+    Each PDF is kept in the page cache under the portfolio's revision and the
+    private images it shows, so only portfolios edited since the last export
+    are sent to wkhtmltopdf again.
+    Portfolios unchanged since a ``previous`` export have their pages copied
+    from its file instead, and the pages of each one are recorded in ``manifest``.
+    Pages are rendered in small batches straight to the cache, so the HTML and
+    PDFs of the whole selection are never held in memory together, while the
+    uploaded images of the next portfolios are downscaled in the background.
+    """
+    context = context or RenderContext(layout)
+    head, tail, render_fragment = get_page_layout(context)
+    processor = ImageProcessor()
+    exported = []  # (name, modified) of each portfolio, in order
+    parts = []
+    documents = {}
+
+    def render_batch():
+        with measure(progress, "pdf"):
+            rendered = renderer.render(list(documents.values()))
+        for path, pdf in zip(documents, rendered, strict=True):
+            write_cache_file(path, pdf)
+            if progress:
+                progress.metrics.add_bytes("pdf", len(pdf))
+        documents.clear()
+
+    def get_page_path(portfolio):
+        private_urls = resolver.get_private_urls(get_image_urls(portfolio, context))
+        return get_page_cache_path(layout, "pdf", portfolio, private_urls)
+
+    def get_image_targets(portfolio):
+        # wkhtmltopdf downloads remote images itself, and pages already in the cache need none
+        if os.path.exists(get_page_path(portfolio)):
+            return {}
+        targets = {}
+        for url in get_image_urls(portfolio, context):
+            path = resolver.get_path(url)
+            if path and not resolver.is_static(path):
+                targets[url] = PDF_IMAGE
+        return targets
+
+    with ImagePrefetcher(resolver, processor) as prefetcher, PdfRenderer() as renderer:
+        batch_size = renderer.workers * 2
+        prefetch = get_image_prefetch(prefetcher, get_image_targets, previous)
+        portfolios = iter_portfolios(
+            frappe.parse_json(portfolio_names), progress=progress, prefetch=prefetch, shared=context.portfolios
+        )
+        for portfolio in portfolios:
+            exported.append(frappe._dict(name=portfolio.name, modified=portfolio.modified))
+            reused = previous.find(portfolio) if previous else None
+            if reused:
+                parts.append((previous.path, tuple(reused)))
+                if progress:
+                    progress.increment("reused")
+            else:
+                path = get_page_path(portfolio)
+                parts.append(path)
+                # Touching a cached page keeps it from being evicted as unused
+                if path not in documents and not touch_cache_file(path):
+                    with measure(progress, "render"):
+                        fragment = get_cached_fragment(
+                            layout, portfolio, render_fragment, variant=context.base_url
+                        )
+                    with measure(progress, "inline_images"):
+                        fragment = inline_local_images(
+                            fragment, resolver, target=PDF_IMAGE, processor=processor, prefetcher=prefetcher
+                        )
+                    documents[path] = head + fragment + tail
+                    if len(documents) >= batch_size:
+                        render_batch()
+            if progress:
+                progress.increment("rendered")
+
+        if progress:
+            progress.set_stage("building")
+        if documents:
+            render_batch()
+
+    page_counts = []
+    with measure(progress, "merge"):
+        merge_pdfs(parts, output, page_counts)
+    if manifest is not None:
+        start = 0
+        for portfolio, count in zip(exported, page_counts, strict=True):
+            manifest.record(portfolio, start, start + count)
+            start += count
+
+
+def get_image_prefetch(prefetcher, get_image_targets, previous=None):
+    """Return a ``prefetch`` callback starting the image downloads of each loaded chunk.
+
+    ``get_image_targets`` maps a portfolio to the ``{url: ImageTarget}`` it
+    will fetch; portfolios copied from the ``previous`` export are skipped.
+    """
+    def prefetch(portfolios):
+        targets = {}
+        for portfolio in portfolios:
+            if not (previous and previous.find(portfolio)):
+                targets.update(get_image_targets(portfolio))
+        prefetcher.prefetch(targets)
+
+    return prefetch
+
+
+def get_page_layout(context):
+    """Return the ``(head, tail, render_fragment)`` wrapped around the portfolios of a document."""
+    if context.layout == 'kartoza':
+        return KARTOZA_HTML_HEAD, KARTOZA_HTML_TAIL, partial(render_kartoza_fragment, context=context)
+    # Every assignment gets its own PDF page, so each one carries the form heading
+    head = WORLDBANK_HTML_HEAD + WORLDBANK_HTML_TITLE
+    return head, WORLDBANK_HTML_TAIL, partial(render_worldbank_fragment, context=context)
+
+
+def get_export_status_key(export_id):
+    return f"portfolio_export_status|{export_id}"
+
+
+class ExportProgress:
+    """Counters for a running export, published to the user for background jobs.
+
+    Without an ``export_id`` the counters are still kept but nothing is published,
+    so the layout and document builders can report progress unconditionally.
+    Stage timings are collected on ``metrics`` and logged when the export ends.
+    """
+
+    def __init__(self, export_id=None, total=0):
+        self.export_id = export_id
+        self.user = frappe.session.user
+        self.stage = None
+        self.counters = {
+            "total": total,
+            "rendered": 0,
+            "images_fetched": 0,
+            "images_failed": 0,
+            "reused": 0,
         }
+        self.metrics = ExportMetrics()
+        self._last_published = 0
 
+    def set_stage(self, stage):
+        self.stage = stage
+        self.publish(force=True)
 
+    def increment(self, counter, by=1):
+        self.counters[counter] += by
+        self.publish()
 
-def add_absolute_url_to_img_tags(html_content, base_url):
-    # Regex to find <img> tags with a relative src attribute
-    img_tag_pattern = r'(<img\b[^>]*\bsrc=["\'])(?!http|https|//)([^"\']*)(["\'])'
-    
-    # Use re.sub with a function to replace matches
-    def replace_with_absolute_url(match):
-        # Get the prefix, relative src, and suffix
-        prefix, relative_src, suffix = match.groups()
-        # Construct the absolute URL
-        absolute_src = urljoin(base_url, relative_src)
-        # Return the updated tag
-        return f"{prefix}{absolute_src}{suffix}"
-    
-    # Substitute all matches with the updated src
-    updated_html = re.sub(img_tag_pattern, replace_with_absolute_url, html_content)
-    return updated_html
+    def update(self, **counters):
+        self.counters.update(counters)
+        self.publish()
 
-def generate_kartoza_html_content(portfolios):
-    project_details = ""
-    portfolio_names = frappe.parse_json(portfolios)
-    for docname in portfolio_names:
-        portfolio = frappe.get_doc("Portfolio", docname)
-        technologies_list = ""
-        for tech in portfolio.technologies:
-            technologies_list += f"<li>{tech.technology}</li>"
-        
-        client_contact = portfolio.contact if portfolio.contact != "" else "Unavailable"
-        client_reference = portfolio.client_reference if portfolio.client_reference != "" else "Unavailable"
-        client_logo = frappe.utils.get_url() + portfolio.client_logo if portfolio.client_logo  else ""
-
-        services_list = ""
-        for service in portfolio.services_listed:
-            services_list += f"<li>{service.service}</li>"
-
-        absolute_url = frappe.utils.get_url() 
-        time = absolute_url + "/assets/portfolio/images/time.png"
-        location = absolute_url + "/assets/portfolio/images/location.png"
-        person = absolute_url + "/assets/portfolio/images/person.png"
-        footer = absolute_url + "/assets/portfolio/images/footer.png"
-
-        portfolio_body =  add_absolute_url_to_img_tags(portfolio.body, absolute_url)
-
-        images_list = ""
-        for image in portfolio.images:
-            if image and image.website_image:
-                image_url = image.website_image
-                if not image_url.startswith(('http://', 'https://')):
-                    image_url = frappe.utils.get_url() + image_url
-                images_list += f'<img src="{image_url}" alt="Screenshot" style="width:100%; height:auto; object-fit:contain; padding:10px;"><br>'
-
-        project_details += f"""
-        <div style="page-break-after:always">
-            <div style="height:100%; position:relative">
-                <h3 style="color:#f4b340; text-align:center;">Kartoza Project Sheet</h3>
-                <h2 style="text-align:center;">{portfolio.title}</h2>
-                <div>
-                    <hr style="border: 8px solid #f4b340; width: 90px; margin:auto;">
-                </div>
-                <br><br>
-                <table style="width:100%; border-collapse:collapse;">
-                    <tr>
-                        <td style="width:33%; text-align:center; border:1px solid gray; padding:10px;">
-                            <div>
-                                <img src="{person}" alt="Project Image" style="width:80px; height:auto;">
-                                <p>Client: {portfolio.client}</p>
-                            </div>
-                        </td>
-                        <td style="width:33%; text-align:center; border:1px solid gray; padding:10px;">
-                            <img src="{location}" alt="Project Image" style="width:80px; height:auto;">
-                            <p>Location: {portfolio.location}</p>
-                        </td>
-                        <td style="width:33%; text-align:center; border:1px solid gray; padding:10px;">
-                            <img src="{time}" alt="Project Image" style="width:80px; height:auto;">
-                            <p>Period: {portfolio.start_date} - {portfolio.end_date}</p>
-                        </td>
-                    </tr>
-                </table>
-                <table style="width:100%; border-collapse:collapse;">
-                    <tr>
-                        <td style="width:40%; border:1px solid gray; vertical-align:top; padding:10px;">
-                            <div style="width:100%; height:100px; border:1px solid gray;">
-                                <img src="{client_logo}" style="width:100%;height:100px; object-fit:contain;"/>
-                            </div>
-                            <div style="width:100%; height:100px; border:1px solid gray;">
-                                Client reference: {client_reference}
-                            </div>
-                            <div style="width:100%; height:100px; border:1px solid gray;">
-                                Client contact: {client_contact}
-                            </div>
-                        </td>
-                        <td style="width:60%; border:1px solid gray; vertical-align:top; padding:10px;">
-                            <div style="width:100%;overflow:hidden;">
-                                {images_list}
-                            </div>
-                        </td>
-                    </tr>
-                </table>
-                <table style="width:100%; border-collapse:collapse;">
-                    <tr>
-                        <td style="width:55%; border:1px solid gray; padding:10px;">
-                            <p>Project Description</p>
-                            <p>{portfolio_body}</p>
-                        </td>
-                        <td style="width:45%; border:1px solid gray; padding:10px;vertical-align: top;">
-                            <div>
-                                <p>Services Provided</p>
-                                <ul>
-                                    {services_list}
-                                </ul>
-                            </div>
-                        </td>
-                    </tr>
-                </table>
-                <div>
-                    <img src="{footer}" alt="Project Image" style="width:100%; height:220px; text-align:center; position:absolute; bottom:8px; left:0;">
-                </div>
-            </div>
-        </div>
-        """
-
-    content = f"""
+    def complete(self, file_url, file_name=None):
+        self.stage = "complete"
+        self.publish(status="success", file_url=file_url, file_name=file_name, force=True)
+
+    def fail(self, message):
+        self.stage = "failed"
+        self.publish(status="failed", message=message, force=True)
+
+    def publish(self, status="running", force=False, **extra):
+        if not self.export_id:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_published < EXPORT_PROGRESS_INTERVAL:
+            return
+        self._last_published = now
+
+        message = {
+            "job_id": self.export_id,
+            "status": status,
+            "stage": self.stage,
+            "user": self.user,
+            **self.counters,
+            **extra,
+        }
+        frappe.cache().set_value(
+            get_export_status_key(self.export_id), message, expires_in_sec=EXPORT_STATUS_TTL
+        )
+        frappe.publish_realtime(EXPORT_PROGRESS_EVENT, message, user=self.user)
+
+
+KARTOZA_SHEET_TEMPLATE = "portfolio/templates/export/kartoza_sheet.html"
+KARTOZA_HTML_HEAD = """
     <html>
     <head>
         <title>Kartoza Project Sheet</title>
+        <style>
+            .sheet { page-break-after: always; }
+            .sheet-page { height: 100%; position: relative; }
+            .sheet-kicker { color: #f4b340; text-align: center; }
+            .sheet-title { text-align: center; }
+            .sheet-rule { border: 8px solid #f4b340; width: 90px; margin: auto; }
+            .sheet-table { width: 100%; border-collapse: collapse; }
+            .sheet-table td { border: 1px solid gray; padding: 10px; }
+            .sheet-summary td { width: 33%; text-align: center; }
+            .sheet-table td.top { vertical-align: top; }
+            .sheet-table td.col-40 { width: 40%; }
+            .sheet-table td.col-45 { width: 45%; }
+            .sheet-table td.col-55 { width: 55%; }
+            .sheet-table td.col-60 { width: 60%; }
+            .sheet-icon { width: 80px; height: auto; }
+            .sheet-box { width: 100%; height: 100px; border: 1px solid gray; }
+            .sheet-logo { width: 100%; height: 100px; object-fit: contain; }
+            .sheet-gallery { width: 100%; overflow: hidden; }
+            .sheet-screenshot { width: 100%; height: auto; object-fit: contain; padding: 10px; }
+            .sheet-footer { width: 100%; height: 220px; text-align: center; position: absolute; bottom: 8px; left: 0; }
+        </style>
     </head>
     <body style="
         display: flex;
         flex-direction: column;
         ">
-        {project_details}
-        
+    """
+KARTOZA_HTML_TAIL = """
     </body>
     </html>
     """
-    return content
 
 
-def generate_html_file(content):
-    absolute_url = frappe.utils.get_url() 
-    footer = absolute_url + "/assets/portfolio/images/footer.png"
-    str_to_remove = f'<img src="{footer}" alt="Project Image" style="width:100%; height:220px; text-align:center; position:absolute; bottom:8px; left:0;">'
-    result = content.replace(str_to_remove, "")
-    # result = result.replace('<div style="page-break-after:always">', '<div style="page-break-after:always;height:110%">')
-    output = io.BytesIO()
-    output.write(result.encode('utf-8'))
-    output.seek(0)
-    return output.getvalue()
+def iter_kartoza_html_content(portfolios, progress=None, context=None):
+    """Yield the Kartoza HTML document piece by piece, one portfolio at a time."""
+    portfolio_names = frappe.parse_json(portfolios)
+    context = context or RenderContext("kartoza")
+    render_fragment = partial(render_kartoza_fragment, context=context)
+    yield KARTOZA_HTML_HEAD
+    for portfolio in iter_portfolios(portfolio_names, progress=progress, shared=context.portfolios):
+        with measure(progress, "render"):
+            fragment = get_cached_fragment("kartoza", portfolio, render_fragment, variant=context.base_url)
+        yield fragment
+        if progress:
+            progress.increment("rendered")
+    yield KARTOZA_HTML_TAIL
 
 
-def strip_html_tags(text):
-    """Remove HTML tags from a string."""
-    clean = re.compile('<.*?>')
-    return re.sub(clean, '', unescape(text))
+def render_kartoza_fragment(portfolio, context=None):
+    """Render the Kartoza project sheet page of a single portfolio."""
+    sheet = get_kartoza_sheet(portfolio, context or RenderContext("kartoza"))
+    return frappe.render_template(KARTOZA_SHEET_TEMPLATE, {"sheet": sheet})
 
 
+def remove_footer_image(content):
+    """Drop the print footer, which only makes sense on fixed-size PDF pages."""
+    return FOOTER_IMAGE_PATTERN.sub("", content)
 
-def generate_docx_from_html(html_content):
-    # Parse the HTML content
-    soup = BeautifulSoup(html_content, 'html.parser')
 
-    # Create a new Document
-    doc = Document()
+def export_html_bundle(
+    portfolio_names, layout, path, html_file_name, manifest, previous=None, progress=None, resolver=None, context=None
+):
+    """Write the HTML bundle of the selected portfolios at ``path``.
+
+    Portfolios unchanged since a ``previous`` export are copied, along with their
+    images, from its archive; the bytes of each one in the page are recorded in
+    ``manifest``. The images of the next portfolios download while the current
+    ones are written.
+    """
+    context = context or RenderContext(layout)
+    head, tail, render_fragment = get_page_layout(context)
+    resolver = resolver or LocalAssetResolver(context.base_url)
+    exported = []  # (name, modified) of each portfolio, in order
+
+    def get_image_targets(portfolio):
+        return dict.fromkeys(get_image_urls(portfolio, context), HTML_IMAGE)
+
+    def iter_chunks(previous_html, prefetch):
+        yield head
+        portfolios = iter_portfolios(
+            frappe.parse_json(portfolio_names), progress=progress, prefetch=prefetch, shared=context.portfolios
+        )
+        for portfolio in portfolios:
+            exported.append(frappe._dict(name=portfolio.name, modified=portfolio.modified))
+            reused = previous.find(portfolio) if previous else None
+            if reused:
+                yield previous_html[reused[0]:reused[1]]
+                if progress:
+                    progress.increment("reused")
+            else:
+                with measure(progress, "render"):
+                    fragment = get_cached_fragment(layout, portfolio, render_fragment, variant=context.base_url)
+                yield fragment
+            if progress:
+                progress.increment("rendered")
+        yield tail
+
+    with ImagePrefetcher(resolver) as prefetcher:
+        prefetch = get_image_prefetch(prefetcher, get_image_targets, previous)
+        options = {"progress": progress, "resolver": resolver, "prefetcher": prefetcher}
+        if previous:
+            with zipfile.ZipFile(previous.path) as source:
+                previous_html = source.read(get_bundle_html_name(source))
+                offsets = write_html_export(
+                    iter_chunks(previous_html, prefetch), path, html_file_name, source=source, **options
+                )
+        else:
+            offsets = write_html_export(iter_chunks(None, prefetch), path, html_file_name, **options)
+
+    # The first and last chunks are the layout's head and tail
+    for portfolio, (start, stop) in zip(exported, offsets[1:-1], strict=True):
+        manifest.record(portfolio, start, stop)
 
-    # Add the title (h3)
-    title = soup.find('h3')
-    if title:
-        doc.add_heading(title.text.strip(), level=1)
-
-    # Add the subtitle (h2)
-    subtitle = soup.find('h2')
-    if subtitle:
-        doc.add_heading(subtitle.text.strip(), level=2)
-
-    # Find all tables and add them to the document
-    tables = soup.find_all('table')
-    for table in tables:
-        rows = table.find_all('tr')
-        if rows:
-            first_row_cells = rows[0].find_all('td')
-            doc_table = doc.add_table(rows=len(rows), cols=len(first_row_cells))
-            for i, row in enumerate(rows):
-                cells = row.find_all('td')
-                for j, cell in enumerate(cells):
-                    cell_content = cell.get_text(strip=True)
-                    
-                    # Only add text content from the cell if there's no <ul> inside it
-                    ul = cell.find('ul')
-                    if not ul:
-                        doc_table.cell(i, j).text = cell_content
-
-                    # Handle images inside table cells
-                    img_tag = cell.find('img')
-                    if img_tag and img_tag.get('src'):
-                        image_url = img_tag['src']
-                        try:
-                            response = requests.get(image_url)
-                            image_data = BytesIO(response.content)
-                            doc_table.cell(i, j).add_paragraph().add_run().add_picture(image_data, width=Inches(1.5))
-                        except requests.RequestException:
-                            print(f"Failed to download image from {image_url}")
-
-                    # Check for <ul> inside the cell and handle it separately
-                    if ul:
-                        for li in ul.find_all('li'):
-                            # Add each list item as a bullet point in the same cell
-                            doc_table.cell(i, j).add_paragraph(li.get_text(strip=True), style='ListBullet')
-
-    # Add the footer image
-    # footer_img_tag = soup.find('img', alt='Project Image')
-    # if footer_img_tag and footer_img_tag.get('src'):
-    #     footer_img_url = footer_img_tag['src']
-    #     try:
-    #         response = requests.get(footer_img_url)
-    #         footer_image_data = BytesIO(response.content)
-    #         doc.add_picture(footer_image_data, width=Inches(6))  # Adjust size as needed
-    #     except requests.RequestException:
-    #         print(f"Failed to download footer image from {footer_img_url}")
-
-    # Save the document
-    output = io.BytesIO()
-    doc.save(output)
-    return output.getvalue()
-
-def generate_docx_content(portfolios):
+
+def get_bundle_html_name(zip_file):
+    return next(name for name in zip_file.namelist() if name.endswith(".html"))
+
+
+def write_html_export(chunks, path, html_file_name, progress=None, source=None, resolver=None, prefetcher=None):
+    """Write a self-contained HTML bundle as a compressed ZIP archive at ``path``.
+
+    The HTML is streamed chunk by chunk to a temporary file while the images each
+    chunk refers to are added to the archive, so only one portfolio's markup is
+    held in memory regardless of how many are exported. Chunks given as bytes
+    are markup already bundled in the archive ``source`` and are copied as is.
+    Images ``prefetcher`` has downloaded already are taken from it. Returns the
+    ``(start, stop)`` bytes of every chunk in the HTML file.
+    """
+    offsets = []
+    try:
+        with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file, \
+                tempfile.NamedTemporaryFile(suffix=".html") as html_file:
+            bundle = ImageBundle(
+                zip_file,
+                resolver=resolver or LocalAssetResolver(),
+                progress=progress,
+                target=HTML_IMAGE,
+                prefetcher=prefetcher,
+            )
+            for chunk in chunks:
+                if isinstance(chunk, bytes):
+                    bundle.copy(chunk.decode('utf-8'), source)
+                else:
+                    chunk = bundle.rewrite(remove_footer_image(chunk)).encode('utf-8')
+                start = html_file.tell()
+                html_file.write(chunk)
+                offsets.append((start, html_file.tell()))
+            html_file.flush()
+            zip_file.write(html_file.name, html_file_name)
+    except Exception:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return offsets
+
+
+def get_export_file_path(file_name):
+    """Return a free ``(file_name, path)`` pair in the site's private files."""
+    path = frappe.get_site_path("private", "files", file_name)
+    if os.path.exists(path):
+        name, extension = os.path.splitext(file_name)
+        file_name = f"{name}_{frappe.generate_hash(length=6)}{extension}"
+        path = frappe.get_site_path("private", "files", file_name)
+    return file_name, path
+
+
+def insert_export_file(file_name, path):
+    """Register an export already written to private files as a File document."""
+    file_doc = frappe.get_doc({
+        "doctype": "File",
+        "file_name": file_name,
+        "file_url": f"/private/files/{file_name}",
+        "is_private": 1,
+        "file_size": os.path.getsize(path),
+    })
+    file_doc.insert()
+    return file_doc
+
+
+def generate_docx_content(
+    portfolios, output, progress=None, resolver=None, manifest=None, previous=None, context=None
+):
+    """Create a Kartoza format DOCX document straight from the Portfolio records."""
     document = Document()
-    
-    # Define image paths
-    base_url = frappe.utils.get_url()
-    image_paths = {
-        'time': f"{base_url}/assets/portfolio/images/time.png",
-        'location': f"{base_url}/assets/portfolio/images/location.png",
-        'person': f"{base_url}/assets/portfolio/images/person.png",
-        'footer': f"{base_url}/assets/portfolio/images/footer.png"
-    }
-    
+    context = context or RenderContext("kartoza")
+    resolver = resolver or LocalAssetResolver(context.base_url)
+    sheets = {}
+    images = {}
+
+    def prepare_chunk(portfolios):
+        # Collect every logo and screenshot of the chunk plus the footer and download
+        # them in one batch, scaled down to the size they are shown at; most were
+        # started by the prefetcher while the previous chunk was being added
+        sheets.clear()
+        images.clear()
+        sheets.update((portfolio.name, get_kartoza_sheet(portfolio, context)) for portfolio in portfolios)
+        targets = {}
+        for sheet in sheets.values():
+            targets.update(get_docx_image_targets(sheet))
+        footer_url = context.icons.footer if sheets else None
+        images.update(
+            fetch_images(
+                [*targets, footer_url], progress=progress, resolver=resolver, targets=targets, prefetcher=prefetcher
+            )
+        )
+
+    def add_sheet(portfolio):
+        add_kartoza_sheet(document, sheets[portfolio.name], images)
+
     # Parse JSON
     portfolio_names = frappe.parse_json(portfolios)
+    with ImagePrefetcher(resolver) as prefetcher:
+        prefetch = get_image_prefetch(
+            prefetcher, lambda portfolio: get_docx_image_targets(get_kartoza_sheet(portfolio, context)), previous
+        )
+        write_docx_portfolios(
+            document,
+            portfolio_names,
+            add_sheet,
+            output,
+            manifest,
+            previous,
+            progress,
+            prepare_chunk=prepare_chunk,
+            prefetch=prefetch,
+            shared=context.portfolios,
+        )
+
+
+def get_docx_image_targets(sheet):
+    """Return the size each image of a Kartoza sheet is shown at in DOCX."""
+    targets = dict.fromkeys(sheet.images, DOCX_SCREENSHOT_IMAGE)
+    targets[sheet.client_logo] = DOCX_LOGO_IMAGE
+    return targets
+
+
+def add_kartoza_sheet(document, sheet, images):
+    """Add one Kartoza project sheet page to a DOCX document."""
+    # Create a title
+    document.add_heading('Kartoza Project Sheet', level=2).alignment = 1  # Center alignment
+    document.add_heading(sheet.title, level=1).alignment = 1  # Center alignment
+
+    # Add a horizontal line
+    document.add_paragraph().add_run().add_break()
+    p = document.add_paragraph()
+    p.add_run().add_break()
+    p.add_run().add_break()
     
-    for docname in portfolio_names:
-        portfolio = frappe.get_doc("Portfolio", docname)
-
-        # Create a title
-        document.add_heading('Kartoza Project Sheet', level=2).alignment = 1  # Center alignment
-        document.add_heading(portfolio.title, level=1).alignment = 1  # Center alignment
-
-        # Add a horizontal line
-        document.add_paragraph().add_run().add_break()
-        p = document.add_paragraph()
-        p.add_run().add_break()
-        p.add_run().add_break()
-        
-        # Add project information table
-        table = document.add_table(rows=1, cols=3)
-        table.style = 'Table Grid'
-        hdr_cells = table.rows[0].cells
-        hdr_cells[0].text = 'Client'
-        hdr_cells[1].text = 'Location'
-        hdr_cells[2].text = 'Period'
-        
-        row_cells = table.add_row().cells
-        row_cells[0].text = portfolio.client
-        row_cells[1].text = portfolio.location
-        row_cells[2].text = f"{portfolio.start_date} - {portfolio.end_date}"
-
-        # Add client details table
-        document.add_paragraph().add_run().add_break()
-        table = document.add_table(rows=1, cols=2)
-        table.style = 'Table Grid'
-        hdr_cells = table.rows[0].cells
-        hdr_cells[0].text = 'Client Reference'
-        hdr_cells[1].text = 'Client Contact'
-        
-        row_cells = table.add_row().cells
-        row_cells[0].text = portfolio.client_reference if portfolio.client_reference else 'Unavailable'
-        row_cells[1].text = portfolio.contact if portfolio.contact else 'Unavailable'
-
-        # Add project description and services
-        document.add_heading('Project Description', level=2)
-        description_text = strip_html_tags(portfolio.body)
-        document.add_paragraph(description_text)
-        
-        document.add_heading('Services Provided', level=2)
-        services_list = '\n'.join([service.service for service in portfolio.services_listed])
-        document.add_paragraph(services_list)
-
-        # Add images
-        if portfolio.images:
-            document.add_heading('Project Images', level=2)
-            for image in portfolio.images:
-                if image and image.website_image:
-                    image_url = image.website_image
-                    # Check if the URL is missing a schema and prepend one if necessary
-                    if not image_url.startswith(('http://', 'https://')):
-                        image_url = frappe.utils.get_url() + image_url
-                    try:
-                        response = requests.get(image_url)
-                        response.raise_for_status()  # Check if the request was successful
-                        image_stream = io.BytesIO(response.content)
-                        document.add_picture(image_stream, width=Inches(5))  # Adjust width as needed
-                        document.add_paragraph().add_run().add_break()
-                    except requests.RequestException:
-                        print(f"Could not fetch image from {image_url}")
-
-        # Add footer image
-        footer_image_url = image_paths['footer']
-        try:
-            response = requests.get(footer_image_url)
-            response.raise_for_status()  # Check if the request was successful
-            footer_image_stream = io.BytesIO(response.content)
-            document.add_picture(footer_image_stream, width=Inches(6))
-        except requests.RequestException:
-            print(f"Could not fetch footer image from {footer_image_url}")
-
-        # Add page break after each portfolio
-        document.add_page_break()
+    # Add project information table
+    table = document.add_table(rows=1, cols=3)
+    table.style = 'Table Grid'
+    hdr_cells = table.rows[0].cells
+    hdr_cells[0].text = 'Client'
+    hdr_cells[1].text = 'Location'
+    hdr_cells[2].text = 'Period'
     
-    output = io.BytesIO()
-    document.save(output)
-    return output.getvalue()
+    row_cells = table.add_row().cells
+    row_cells[0].text = sheet.client or ""
+    row_cells[1].text = sheet.location or ""
+    row_cells[2].text = sheet.period
 
+    # Add client details table
+    document.add_paragraph().add_run().add_break()
+    if images.get(sheet.client_logo):
+        add_picture(document, images[sheet.client_logo], Inches(2))
+    table = document.add_table(rows=1, cols=2)
+    table.style = 'Table Grid'
+    hdr_cells = table.rows[0].cells
+    hdr_cells[0].text = 'Client Reference'
+    hdr_cells[1].text = 'Client Contact'
+    
+    row_cells = table.add_row().cells
+    row_cells[0].text = sheet.client_reference
+    row_cells[1].text = sheet.client_contact
 
-def worldbank_format_html(portfolios):
-    """Create a World Bank format HTML document for the given portfolios."""
-    portfolio_names = frappe.parse_json(portfolios)
+    # Add project description and services
+    document.add_heading('Project Description', level=2)
+    document.add_paragraph(sheet.body.text)
     
-    # Initialize the HTML string
-    html = """
+    document.add_heading('Services Provided', level=2)
+    for service in sheet.services:
+        document.add_paragraph(service, style='List Bullet')
+
+    # Add images
+    if sheet.images:
+        document.add_heading('Project Images', level=2)
+        for image_url in sheet.images:
+            if images.get(image_url) and add_picture(document, images[image_url], Inches(5)):
+                document.add_paragraph().add_run().add_break()
+
+    # Add footer image
+    if images.get(sheet.icons.footer):
+        add_picture(document, images[sheet.icons.footer], Inches(6))
+
+    # Add page break after each portfolio
+    document.add_page_break()
+
+
+def write_docx_portfolios(
+    document,
+    portfolio_names,
+    add_portfolio,
+    output,
+    manifest=None,
+    previous=None,
+    progress=None,
+    prepare_chunk=None,
+    prefetch=None,
+    shared=None,
+):
+    """Add every portfolio to ``document`` with ``add_portfolio`` and save it to ``output``.
+
+    Portfolios are loaded a chunk at a time; ``prepare_chunk`` is called with
+    the ones of each chunk that are about to be added, e.g. to fetch their
+    images together, and ``prefetch`` as soon as the chunk is loaded, ahead of
+    the chunk being added (see ``iter_portfolio_chunks``). Portfolios unchanged
+    since a ``previous`` export are copied from its document instead, and the
+    body elements of each one are recorded in ``manifest``. Chunks ``shared``
+    has loaded already are taken from it.
+    """
+    source = Document(previous.path) if previous else None
+    for portfolios in iter_portfolio_chunks(portfolio_names, progress=progress, prefetch=prefetch, shared=shared):
+        reused = {portfolio.name: previous.find(portfolio) for portfolio in portfolios} if previous else {}
+        if prepare_chunk:
+            prepare_chunk([portfolio for portfolio in portfolios if not reused.get(portfolio.name)])
+        for portfolio in portfolios:
+            start = get_docx_body_length(document)
+            with measure(progress, "docx"):
+                if reused.get(portfolio.name):
+                    copy_docx_elements(source, *reused[portfolio.name], document)
+                else:
+                    add_portfolio(portfolio)
+            if manifest is not None:
+                manifest.record(portfolio, start, get_docx_body_length(document))
+            if progress:
+                if reused.get(portfolio.name):
+                    progress.increment("reused")
+                progress.increment("rendered")
+
+    with measure(progress, "docx"):
+        document.save(output)
+
+
+def get_docx_body_length(document):
+    """Return the number of body elements, leaving out the trailing section properties."""
+    body = document.element.body
+    return len(body) - 1 if body.sectPr is not None else len(body)
+
+
+def copy_docx_elements(source, start, stop, document):
+    """Append body elements ``start:stop`` of the ``source`` document, with their images."""
+    body = document.element.body
+    for element in source.element.body[start:stop]:
+        element = copy.deepcopy(element)
+        for blip in element.iter(qn("a:blip")):
+            image_part = source.part.related_parts[blip.get(qn("r:embed"))]
+            blip.set(qn("r:embed"), document.part.get_or_add_image(io.BytesIO(image_part.blob))[0])
+        # Drawing ids must stay unique within the new document
+        for properties in element.iter(qn("wp:docPr")):
+            properties.set("id", str(document.part.next_id))
+        if body.sectPr is not None:
+            body.sectPr.addprevious(element)
+        else:
+            body.append(element)
+
+
+def add_picture(document, image_data, width):
+    """Add an image paragraph, skipping formats python-docx cannot embed."""
+    try:
+        document.add_picture(io.BytesIO(image_data), width=width)
+        return True
+    except UnrecognizedImageError:
+        return False
+
+
+WORLDBANK_ASSIGNMENT_TEMPLATE = "portfolio/templates/export/world_bank_assignment.html"
+WORLDBANK_HTML_HEAD = """
     <!DOCTYPE html>
     <html lang="en">
     <head>
@@ -451,87 +993,49 @@ def worldbank_format_html(portfolios):
         </style>
     </head>
     <body>
+    """
+WORLDBANK_HTML_TITLE = """
         <h1>Assignment Details</h1>
     """
+WORLDBANK_HTML_TAIL = """
+    </body>
+    </html>
+    """
+
+
+def iter_worldbank_format_html(portfolios, progress=None, context=None):
+    """Yield the World Bank HTML document piece by piece, one portfolio at a time."""
+    portfolio_names = frappe.parse_json(portfolios)
+    context = context or RenderContext("world bank")
+    render_fragment = partial(render_worldbank_fragment, context=context)
+
+    yield WORLDBANK_HTML_HEAD
+    yield WORLDBANK_HTML_TITLE
 
     # Loop through each portfolio and generate the HTML content
-    for portfolio_name in portfolio_names:
-        details = frappe.get_doc("Portfolio", portfolio_name)
-        
-        html += f"""
-        <h2>{details.title}</h2>
-        <table>
-            <tr>
-                <th>Assignment name:</th>
-                <td>{details.title}</td>
-            </tr>
-            <tr>
-                <th>Approx. value of the contract (in current US$):</th>
-                <td>{details.approximate_contract_value}</td>
-            </tr>
-            <tr>
-                <th>Country:</th>
-                <td>{details.location}</td>
-            </tr>
-            <tr>
-                <th>Duration of assignment (months):</th>
-                <td>{details.duration_of_assignment}</td>
-            </tr>
-            <tr>
-                <th>Name of Client(s):</th>
-                <td>{details.client}</td>
-            </tr>
-            <tr>
-                <th>Contact Person, Title/Designation, Tel. No./Address:</th>
-                <td>{details.contact}</td>
-            </tr>
-            <tr>
-                <th>Start Date (month/year):</th>
-                <td>{details.start_date}</td>
-            </tr>
-            <tr>
-                <th>End Date (month/year):</th>
-                <td>{details.end_date}</td>
-            </tr>
-            <tr>
-                <th>Total No. of staff-months of the assignment:</th>
-                <td>{details.total_staff_months}</td>
-            </tr>
-            <tr>
-                <th>No. of professional staff-months provided by your consulting firm/organization or your sub consultants:</th>
-                <td>{details.total_staff_months}</td>
-            </tr>
-            <tr>
-                <th>Name of associated Consultants, if any:</th>
-                <td></td>
-            </tr>
-            <tr>
-                <th>Name of senior professional staff of your consulting firm/organization involved and designation and/or functions performed:</th>
-                <td></td>
-            </tr>
-            <tr>
-                <th>Description of Project:</th>
-                <td>{details.body}</td>
-            </tr>
-            <tr>
-                <th>Description of actual services provided by your staff within the assignment:</th>
-                <td>{details.services_listed}</td>
-            </tr>
-        </table>
-        """
+    for details in iter_portfolios(portfolio_names, progress=progress, shared=context.portfolios):
+        with measure(progress, "render"):
+            fragment = get_cached_fragment("world bank", details, render_fragment, variant=context.base_url)
+        yield fragment
+        if progress:
+            progress.increment("rendered")
 
     # Close the HTML tags
-    html += """
-    </body>
-    </html>
-    """
+    yield WORLDBANK_HTML_TAIL
+
 
-    return html
+def render_worldbank_fragment(details, context=None):
+    """Render the World Bank assignment table of a single portfolio."""
+    return frappe.render_template(WORLDBANK_ASSIGNMENT_TEMPLATE, {
+        "details": details,
+        "rows": get_worldbank_rows(details, context or RenderContext("world bank")),
+    })
 
 
-def worldbank_format(portfolios):
+def worldbank_format(portfolios, output, progress=None, manifest=None, previous=None, context=None):
     """Create a World Bank format document for the given portfolios."""
     portfolio_names = frappe.parse_json(portfolios)
+    context = context or RenderContext("world bank")
     doc = Document()
 
     # Add Title
@@ -540,51 +1044,34 @@ def worldbank_format(portfolios):
     title_run.bold = True
 
     # Loop through each portfolio and create a table
-    for portfolio_name in portfolio_names:
-        details = frappe.get_doc("Portfolio", portfolio_name)
-
-        # Add a heading for each portfolio
-        doc.add_heading(details.title, level=2)
-
-        # Create a table for the details
-        table = doc.add_table(rows=14, cols=2)
-        table.style = 'Table Grid'
-        table.autofit = False
-
-        # Set the width of the table columns
-        for row in table.rows:
-            row.cells[0].width = Pt(200)
-            row.cells[1].width = Pt(300)
-
-        # Add the details to the table
-        details_dict = {
-            "Assignment name:": details.title,
-            "Approx. value of the contract (in current US$):": details.approximate_contract_value,
-            "Country:": details.location,
-            "Duration of assignment (months):": details.duration_of_assignment,
-            "Name of Client(s):": details.client,
-            "Contact Person, Title/Designation, Tel. No./Address:": details.contact,
-            "Start Date (month/year):": details.start_date,
-            "End Date (month/year):": details.end_date,
-            "Total No. of staff-months of the assignment:": details.total_staff_months,
-            "No. of professional staff-months provided by your consulting firm/organization or "
-            "your sub consultants:": details.total_staff_months,
-            "Name of associated Consultants, if any:": "",
-            "Name of senior professional staff of your consulting firm/organization involved and "
-            "designation and/or functions performed (e.g. Project Director/ Coordinator, "
-            "Team Leader):": "",
-            "Description of Project:": details.body,
-            "Description of actual services provided by your staff within the "
-            "assignment:": details.services_listed,
-        }
+    def add_table(details):
+        add_worldbank_table(doc, details, context)
+
+    write_docx_portfolios(
+        doc, portfolio_names, add_table, output, manifest, previous, progress, shared=context.portfolios
+    )
+
+
+def add_worldbank_table(doc, details, context):
+    """Add one World Bank assignment heading and table to a DOCX document."""
+    # Add a heading for each portfolio
+    doc.add_heading(details.title, level=2)
+
+    rows = get_worldbank_rows(details, context, text=True)
+
+    # Create a table for the details
+    table = doc.add_table(rows=len(rows), cols=2)
+    table.style = 'Table Grid'
+    table.autofit = False
 
-        # Populate the table with the correct details
-        for i, (key, value) in enumerate(details_dict.items()):
-            cell1 = table.cell(i, 0)
-            cell2 = table.cell(i, 1)
-            cell1.text = key
-            cell2.text = str(value) if value else ""
+    # Set the width of the table columns
+    for row in table.rows:
+        row.cells[0].width = Pt(200)
+        row.cells[1].width = Pt(300)
 
-    output = io.BytesIO()
-    doc.save(output)
-    return output.getvalue()
+    # Populate the table with the correct details
+    for i, (key, value) in enumerate(rows):
+        cell1 = table.cell(i, 0)
+        cell2 = table.cell(i, 1)
+        cell1.text = key
+        cell2.text = str(value) if value else ""
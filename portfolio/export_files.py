@@ -0,0 +1,111 @@
+import functools
+import hashlib
+import json
+import os
+
+import frappe
+from frappe.utils import add_days, cint, now_datetime
+
+import portfolio
+
+# Identical exports (same user, portfolio revisions, format, layout and options)
+# reuse the File produced the first time. Export Files are pruned once they are
+# older than `portfolio_export_retention_days` (site config, 7 days by default).
+EXPORT_FINGERPRINT_PREFIX = "portfolio_export_fingerprint"
+DEFAULT_RETENTION_DAYS = 7
+EXPORT_FILE_PREFIX = "portfolio_export_"
+
+# Code and templates that shape the exported documents. Their content goes into
+# the export version, so a deploy that changes them never reuses older exports.
+EXPORT_SOURCE_FILES = (
+	"export.py",
+	"layouts.py",
+	"templates/export/kartoza_sheet.html",
+	"templates/export/world_bank_assignment.html",
+)
+
+
+def get_retention_days():
+	return cint(frappe.conf.get("portfolio_export_retention_days")) or DEFAULT_RETENTION_DAYS
+
+
+@functools.cache
+def get_export_version():
+	"""Return a hash of the app version and the export code and templates."""
+	version = hashlib.sha1(portfolio.__version__.encode())
+	app_path = os.path.dirname(os.path.abspath(__file__))
+	for name in EXPORT_SOURCE_FILES:
+		with open(os.path.join(app_path, name), "rb") as f:
+			version.update(f.read())
+	return version.hexdigest()
+
+
+def get_export_fingerprint(portfolio_names, format, layout, **options):
+	"""Return a hash of everything an export's content depends on, or ``None``.
+
+	Portfolios are kept in the selected order since that is the order of the
+	exported document. ``None`` is returned when a portfolio does not exist, so
+	the export itself reports it.
+	"""
+	names = frappe.parse_json(portfolio_names)
+	rows = frappe.get_all(
+		"Portfolio", filters={"name": ["in", list(set(names))]}, fields=["name", "modified"]
+	)
+	modified = {row.name: str(row.modified) for row in rows}
+	if any(name not in modified for name in names):
+		return None
+
+	fingerprint = {
+		"user": frappe.session.user,
+		"portfolios": [[name, modified[name]] for name in names],
+		"format": format,
+		"layout": layout,
+		"options": options,
+		"version": get_export_version(),
+	}
+	return hashlib.sha1(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()
+
+
+def get_fingerprint_key(fingerprint):
+	return f"{EXPORT_FINGERPRINT_PREFIX}|{fingerprint}"
+
+
+def find_export_file(fingerprint):
+	"""Return the File of an earlier identical export, if it is still on disk."""
+	if not fingerprint:
+		return None
+	file_name = frappe.cache().get_value(get_fingerprint_key(fingerprint))
+	if not file_name or not frappe.db.exists("File", file_name):
+		return None
+	file_doc = frappe.get_doc("File", file_name)
+	if not os.path.exists(file_doc.get_full_path()):
+		return None
+	return file_doc
+
+
+def remember_export_file(fingerprint, file_doc):
+	if fingerprint:
+		frappe.cache().set_value(
+			get_fingerprint_key(fingerprint),
+			file_doc.name,
+			expires_in_sec=get_retention_days() * 24 * 60 * 60,
+		)
+
+
+def prune_export_files():
+	"""Delete export Files older than the retention period (daily scheduler job)."""
+	files = frappe.get_all(
+		"File",
+		filters={
+			"file_name": ["like", f"{EXPORT_FILE_PREFIX}%"],
+			"is_private": 1,
+			"attached_to_doctype": ["is", "not set"],
+			"creation": ["<", add_days(now_datetime(), -get_retention_days())],
+		},
+		pluck="name",
+	)
+	for file_name in files:
+		# Deleting the File also removes it from disk and drops its manifest
+		frappe.delete_doc("File", file_name, ignore_permissions=True)
+	if files:
+		frappe.db.commit()
@@ -0,0 +1,109 @@
+import hashlib
+import threading
+import time
+from urllib.parse import urlparse
+
+import frappe
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Remote images are downloaded through one session per process, shared by every
+# export and worker thread so connections to image hosts are kept alive. Each
+# download is bounded in time and size, and at most a few run against any one
+# host at once, so a slow or hostile host cannot stall an export.
+IMAGE_FETCH_TIMEOUT = (5, 30)  # (connect, read) seconds
+IMAGE_FETCH_DEADLINE = 60  # seconds for a whole download, however slowly it trickles in
+IMAGE_FETCH_RETRIES = 2
+IMAGE_FETCH_BACKOFF = 0.5  # seconds, doubled on every retry
+IMAGE_MAX_BYTES = 20 * 1024 * 1024
+IMAGE_HOST_CONNECTIONS = 4
+IMAGE_POOL_SIZE = 16
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# URLs that failed are not requested again for a while, by any worker
+FAILED_URL_PREFIX = "portfolio_image_failed"
+FAILED_URL_TTL = 10 * 60
+
+_session = None
+_session_lock = threading.Lock()
+_host_limits = {}
+_host_limits_lock = threading.Lock()
+
+
+class DownloadError(Exception):
+	pass
+
+
+def get_session():
+	"""Return the process-wide session used to download remote images."""
+	global _session
+	with _session_lock:
+		if _session is None:
+			_session = make_session()
+		return _session
+
+
+def make_session():
+	retry = Retry(
+		total=IMAGE_FETCH_RETRIES,
+		backoff_factor=IMAGE_FETCH_BACKOFF,
+		status_forcelist=(429, 500, 502, 503, 504),
+		allowed_methods=("GET",),
+		respect_retry_after_header=True,
+		raise_on_status=False,
+	)
+	session = requests.Session()
+	adapter = HTTPAdapter(
+		pool_connections=IMAGE_POOL_SIZE, pool_maxsize=IMAGE_HOST_CONNECTIONS, max_retries=retry
+	)
+	session.mount("http://", adapter)
+	session.mount("https://", adapter)
+	return session
+
+
+def get_host_limit(url):
+	host = urlparse(url).netloc.lower()
+	with _host_limits_lock:
+		if host not in _host_limits:
+			_host_limits[host] = threading.BoundedSemaphore(IMAGE_HOST_CONNECTIONS)
+		return _host_limits[host]
+
+
+def download(url, headers=None):
+	"""Return the ``(response, content)`` of a GET of ``url``, or raise ``DownloadError``."""
+	with get_host_limit(url):
+		start = time.monotonic()
+		try:
+			with get_session().get(
+				url, headers=headers, timeout=IMAGE_FETCH_TIMEOUT, stream=True
+			) as response:
+				if response.status_code >= 400:
+					raise DownloadError(f"HTTP {response.status_code}")
+				if int(response.headers.get("Content-Length") or 0) > IMAGE_MAX_BYTES:
+					raise DownloadError("Image is too large")
+
+				chunks = []
+				size = 0
+				for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+					size += len(chunk)
+					if size > IMAGE_MAX_BYTES:
+						raise DownloadError("Image is too large")
+					if time.monotonic() - start > IMAGE_FETCH_DEADLINE:
+						raise DownloadError("Download took too long")
+					chunks.append(chunk)
+				return response, b"".join(chunks)
+		except requests.RequestException as e:
+			raise DownloadError(str(e)) from e
+
+
+def get_failed_url_key(url):
+	return f"{FAILED_URL_PREFIX}|{hashlib.sha1(url.encode()).hexdigest()}"
+
+
+def has_failed_recently(url):
+	return bool(frappe.cache().get_value(get_failed_url_key(url)))
+
+
+def set_failed(url):
+	frappe.cache().set_value(get_failed_url_key(url), 1, expires_in_sec=FAILED_URL_TTL)
@@ -78,6 +78,9 @@ doctype_js = {
 # before_install = "portfolio.install.before_install"
 # after_install = "portfolio.install.after_install"
 
+# Cached export renderings embed the layout templates, so drop them on deploy
+after_migrate = ["portfolio.cache.clear_export_cache"]
+
 # Uninstallation
 # ------------
 
@@ -137,10 +140,27 @@ doctype_js = {
 # 		"on_trash": "method"
 # 	}
 # }
+doc_events = {
+	"Portfolio": {
+		"on_update": "portfolio.cache.invalidate_portfolio_cache",
+		"on_trash": "portfolio.cache.invalidate_portfolio_cache",
+	},
+	"File": {
+		"on_trash": "portfolio.manifest.remove_manifest",
+	},
+}
 
 # Scheduled Tasks
 # ---------------
 
+scheduler_events = {
+	"daily": [
+		"portfolio.export_files.prune_export_files",
+		"portfolio.image_cache.evict_remote_images",
+		"portfolio.cache.evict_export_cache",
+	],
+}
+
 # scheduler_events = {
 # 	"all": [
 # 		"portfolio.tasks.all"
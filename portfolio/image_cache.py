@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import time
+
+import frappe
+from frappe.utils import cint
+
+from portfolio.cache import (
+	evict_cache_files,
+	get_cache_path,
+	get_cache_size,
+	read_cache_file,
+	touch_cache_file,
+	write_cache_file,
+)
+from portfolio.fetch import DownloadError, download
+
+# Remote images are kept on disk by URL. Within the TTL they are used without
+# any request; after it they are revalidated with a conditional GET, which
+# costs no transfer while the image is unchanged. Sites can tune both limits
+# with the `portfolio_image_cache_ttl` (seconds) and `portfolio_image_cache_size`
+# (MB) config keys; the least recently used images are evicted daily.
+DEFAULT_IMAGE_CACHE_TTL = 24 * 60 * 60
+DEFAULT_IMAGE_CACHE_SIZE = 500  # MB
+
+
+def get_image_cache_dir():
+	return get_cache_path("images", "remote")
+
+
+class RemoteImageCache:
+	"""Download remote images through a disk cache revalidated with ETag/Last-Modified."""
+
+	def __init__(self, cache_dir=None, ttl=None):
+		self.cache_dir = cache_dir or get_image_cache_dir()
+		self.ttl = (
+			ttl
+			if ttl is not None
+			else (cint(frappe.conf.get("portfolio_image_cache_ttl")) or DEFAULT_IMAGE_CACHE_TTL)
+		)
+
+	def get_paths(self, url):
+		url_hash = hashlib.sha1(url.encode()).hexdigest()
+		path = os.path.join(self.cache_dir, url_hash[:2], url_hash)
+		return path, f"{path}.json"
+
+	def fetch(self, url):
+		"""Return the content of ``url``, from the cache when it is still valid.
+
+		A stale copy is returned when revalidating it fails, so a host going
+		down does not take images out of exports; without one the
+		``DownloadError`` is raised.
+		"""
+		path, meta_path = self.get_paths(url)
+		meta = read_cache_file(meta_path)
+		meta = json.loads(meta) if meta else None
+		content = read_cache_file(path) if meta else None
+
+		if content is not None and time.time() - meta["fetched_at"] < self.ttl:
+			touch_cache_file(path)
+			return content
+
+		headers = {}
+		if content is not None:
+			if meta.get("etag"):
+				headers["If-None-Match"] = meta["etag"]
+			if meta.get("last_modified"):
+				headers["If-Modified-Since"] = meta["last_modified"]
+
+		try:
+			response, downloaded = download(url, headers=headers)
+		except DownloadError:
+			if content is None:
+				raise
+			return content
+
+		if response.status_code == 304 and content is not None:
+			touch_cache_file(path)
+		else:
+			content = downloaded
+			write_cache_file(path, content)
+			meta = {
+				"etag": response.headers.get("ETag"),
+				"last_modified": response.headers.get("Last-Modified"),
+			}
+		meta["fetched_at"] = time.time()
+		write_cache_file(meta_path, json.dumps(meta).encode())
+		return content
+
+
+def evict_remote_images():
+	"""Remove the least recently used images once the cache exceeds its size (daily job)."""
+	evict_cache_files(
+		get_image_cache_dir(), get_cache_size("portfolio_image_cache_size", DEFAULT_IMAGE_CACHE_SIZE)
+	)
@@ -0,0 +1,99 @@
+import hashlib
+import io
+import os
+from typing import NamedTuple
+
+from PIL import Image, ImageOps
+
+from portfolio.cache import get_cache_path, read_cache_file, touch_cache_file, write_cache_file
+
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+
+# Formats every export target can embed as they are; WebP is only produced for
+# the HTML bundle since python-docx and wkhtmltopdf cannot use it.
+EMBEDDABLE_FORMATS = ("JPEG", "PNG", "GIF")
+IMAGE_SIGNATURES = {
+	b"\xff\xd8\xff": ("jpg", "image/jpeg"),
+	b"\x89PNG\r\n\x1a\n": ("png", "image/png"),
+	b"GIF87a": ("gif", "image/gif"),
+	b"GIF89a": ("gif", "image/gif"),
+}
+
+
+class ImageTarget(NamedTuple):
+	"""The largest size, in pixels, an image is displayed at by a layout/format."""
+
+	max_width: int
+	max_height: int
+	allow_webp: bool = False
+
+	@property
+	def key(self):
+		return f"{self.max_width}x{self.max_height}{'-webp' if self.allow_webp else ''}"
+
+
+class ImageProcessor:
+	"""Downscale and recompress images for a target, caching each derivative on disk."""
+
+	def __init__(self, cache_dir=None):
+		self.cache_dir = cache_dir or get_cache_path("images", "derived")
+
+	def process(self, content, target):
+		source_hash = hashlib.sha1(content).hexdigest()
+		path = os.path.join(self.cache_dir, source_hash[:2], f"{source_hash}-{target.key}")
+		derived = read_cache_file(path)
+		if derived is None:
+			derived = downscale_image(content, target)
+			write_cache_file(path, derived)
+		else:
+			touch_cache_file(path)
+		return derived
+
+
+def downscale_image(content, target):
+	"""Return ``content`` resized to fit ``target`` and recompressed.
+
+	Images that already fit and are in an embeddable format are returned
+	untouched, as is anything Pillow cannot read or a result that would end up
+	larger than the source.
+	"""
+	try:
+		with Image.open(io.BytesIO(content)) as image:
+			if getattr(image, "is_animated", False):
+				return content
+
+			embeddable = image.format in EMBEDDABLE_FORMATS or (target.allow_webp and image.format == "WEBP")
+			if embeddable and image.width <= target.max_width and image.height <= target.max_height:
+				return content
+
+			image = ImageOps.exif_transpose(image)
+			image.thumbnail((target.max_width, target.max_height), Image.LANCZOS)
+			has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+
+			output = io.BytesIO()
+			if target.allow_webp:
+				image.save(output, "WEBP", quality=WEBP_QUALITY)
+			elif has_alpha:
+				image.save(output, "PNG", optimize=True)
+			else:
+				image.convert("RGB").save(
+					output, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True
+				)
+	except (OSError, ValueError, Image.DecompressionBombError):
+		return content
+
+	derived = output.getvalue()
+	if embeddable and len(derived) >= len(content):
+		return content
+	return derived
+
+
+def get_image_type(content):
+	"""Return the ``(extension, mimetype)`` of image bytes, or ``(None, None)`` if unknown."""
+	if content[:4] == b"RIFF" and content[8:12] == b"WEBP":
+		return "webp", "image/webp"
+	for signature, image_type in IMAGE_SIGNATURES.items():
+		if content.startswith(signature):
+			return image_type
+	return None, None
@@ -0,0 +1,360 @@
+import base64
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import cached_property
+from urllib.parse import unquote, urlparse
+
+import frappe
+
+from portfolio.fetch import DownloadError, has_failed_recently, set_failed
+from portfolio.image_cache import RemoteImageCache
+from portfolio.image_processing import ImageProcessor, get_image_type
+from portfolio.metrics import get_logger, measure
+
+# Images are fetched in parallel; see portfolio.fetch for the limits put on
+# every remote download.
+IMAGE_FETCH_WORKERS = 8
+# Images downloaded ahead of the portfolios being rendered and not collected yet
+IMAGE_PREFETCH_LIMIT = 64
+
+IMG_SRC_PATTERN = re.compile(r'(<img\b[^>]*\bsrc=["\'])([^"\']*)(["\'])', re.IGNORECASE)
+
+# Bundled layout assets only change on deploy, which restarts the workers, so
+# each one is read from disk once per process and shared by every export.
+_static_assets = {}
+
+
+class StaticAsset:
+	def __init__(self, path, content):
+		self.path = path
+		self.content = content
+		self.content_hash = hashlib.sha1(content).hexdigest()
+		self.mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+	@cached_property
+	def data_uri(self):
+		return make_data_uri(self.content, self.mimetype)
+
+
+def make_data_uri(content, mimetype):
+	return f"data:{mimetype};base64,{base64.b64encode(content).decode()}"
+
+
+def get_static_asset(path):
+	"""Return the process-wide cached copy of a bundled asset."""
+	asset = _static_assets.get(path)
+	if asset is None:
+		with open(path, "rb") as f:
+			asset = _static_assets[path] = StaticAsset(path, f.read())
+	return asset
+
+
+class LocalAssetResolver:
+	"""Map image URLs served by this site to the files behind them.
+
+	Private files are only mapped when the exporting user can read them, which
+	is checked in the exporting thread; worker threads are refused the rest.
+	"""
+
+	def __init__(self, site_url=None):
+		self.site_url = (site_url or frappe.utils.get_url()).rstrip("/")
+		self.static_root = os.path.realpath(frappe.get_app_path("portfolio", "public", "images"))
+		self.roots = {
+			"/files/": os.path.realpath(frappe.get_site_path("public", "files")),
+			"/private/files/": os.path.realpath(frappe.get_site_path("private", "files")),
+			"/assets/portfolio/images/": self.static_root,
+		}
+		self.private_access = {}  # private file URL -> whether the user can read it
+
+	def get_path(self, url):
+		"""Return the local file for ``url``, or ``None`` if it is not served by this site."""
+		if not url:
+			return None
+		if url.startswith(self.site_url + "/"):
+			url = url[len(self.site_url) :]
+		elif not url.startswith("/") or url.startswith("//"):
+			return None
+
+		url_path = unquote(urlparse(url).path)
+		for prefix, root in self.roots.items():
+			if url_path.startswith(prefix):
+				path = os.path.realpath(os.path.join(root, url_path[len(prefix) :]))
+				# Refuse anything that escapes the root through ".." or symlinks
+				if not path.startswith(root + os.sep) or not os.path.isfile(path):
+					return None
+				if prefix == "/private/files/" and not self.can_read_private_file(url_path):
+					return None
+				return path
+		return None
+
+	def get_private_urls(self, urls):
+		"""Return the URLs among ``urls`` that map to private files the user can read."""
+		private_root = self.roots["/private/files/"] + os.sep
+		return [url for url in urls if (self.get_path(url) or "").startswith(private_root)]
+
+	def can_read_private_file(self, file_url):
+		if file_url not in self.private_access:
+			if not getattr(frappe.local, "site", None):
+				return False
+			self.private_access[file_url] = any(
+				frappe.has_permission("File", "read", doc=name)
+				for name in frappe.get_all("File", filters={"file_url": file_url}, pluck="name")
+			)
+		return self.private_access[file_url]
+
+	def get_asset(self, url):
+		"""Return a ``StaticAsset`` for ``url``, or ``None`` if it is not served by this site.
+
+		Bundled layout assets come from the process-wide cache; uploaded files are
+		read fresh since they can be replaced at any time, and are refused unless
+		they are images.
+		"""
+		path = self.get_path(url)
+		if not path:
+			return None
+		if self.is_static(path):
+			return get_static_asset(path)
+		with open(path, "rb") as f:
+			content = f.read()
+		if get_image_type(content)[0] is None:
+			return None
+		return StaticAsset(path, content)
+
+	def is_static(self, path):
+		return path.startswith(self.static_root + os.sep)
+
+	def read(self, url):
+		asset = self.get_asset(url)
+		return asset.content if asset else None
+
+	def get_data_uri(self, url):
+		asset = self.get_asset(url)
+		return asset.data_uri if asset else None
+
+
+def inline_local_images(html_content, resolver, target=None, processor=None, prefetcher=None):
+	"""Replace ``<img>`` sources served by this site with data URIs, downscaled to ``target``."""
+	processor = processor or (ImageProcessor() if target else None)
+	data_uris = {}
+
+	def get_data_uri(src):
+		asset = resolver.get_asset(src)
+		if not asset:
+			return None
+		if not target or resolver.is_static(asset.path):
+			return asset.data_uri
+		future = prefetcher.pop(src, target) if prefetcher else None
+		content = future.result() if future else processor.process(asset.content, target)
+		return make_data_uri(content, get_image_type(content)[1] or asset.mimetype)
+
+	def replace(match):
+		prefix, src, suffix = match.groups()
+		if src not in data_uris:
+			data_uris[src] = get_data_uri(src)
+		return f"{prefix}{data_uris[src] or src}{suffix}"
+
+	return IMG_SRC_PATTERN.sub(replace, html_content)
+
+
+class ImageBundle:
+	"""Store each image referenced by HTML once in a ZIP archive, under ``images/<sha1><ext>``."""
+
+	folder = "images"
+
+	def __init__(self, zip_file, resolver=None, progress=None, target=None, prefetcher=None):
+		self.zip_file = zip_file
+		self.resolver = resolver
+		self.progress = progress
+		self.target = target
+		self.prefetcher = prefetcher
+		self.processor = ImageProcessor() if target else None
+		self.paths = {}  # source URL -> archive path, or None if it could not be fetched
+		self.stored = {}  # content hash -> archive path
+
+	def rewrite(self, html_content):
+		srcs = (match.group(2) for match in IMG_SRC_PATTERN.finditer(html_content))
+		pending = [
+			src
+			for src in dict.fromkeys(srcs)
+			if src and src not in self.paths and not src.startswith("data:")
+		]
+		images = fetch_images(
+			pending,
+			progress=self.progress,
+			resolver=self.resolver,
+			targets=dict.fromkeys(pending, self.target) if self.target else None,
+			processor=self.processor,
+			prefetcher=self.prefetcher,
+		)
+		for src in pending:
+			self.paths[src] = self.store(src, images.get(src)) if images.get(src) else None
+
+		def replace(match):
+			prefix, src, suffix = match.groups()
+			return f"{prefix}{self.paths.get(src) or src}{suffix}"
+
+		return IMG_SRC_PATTERN.sub(replace, html_content)
+
+	def copy(self, html_content, source):
+		"""Add the images of markup bundled by an earlier export from its archive ``source``."""
+		for match in IMG_SRC_PATTERN.finditer(html_content):
+			path = match.group(2)
+			if not path.startswith(f"{self.folder}/"):
+				continue
+			content_hash = os.path.splitext(os.path.basename(path))[0]
+			if content_hash not in self.stored:
+				self.zip_file.writestr(path, source.read(path), compress_type=zipfile.ZIP_STORED)
+				self.stored[content_hash] = path
+
+	def store(self, src, content):
+		content_hash = hashlib.sha1(content).hexdigest()
+		if content_hash not in self.stored:
+			extension = get_image_type(content)[0]
+			extension = f".{extension}" if extension else os.path.splitext(urlparse(src).path)[1].lower()
+			path = f"{self.folder}/{content_hash}{extension}"
+			# Images are already compressed, deflating them again only costs CPU
+			self.zip_file.writestr(path, content, compress_type=zipfile.ZIP_STORED)
+			self.stored[content_hash] = path
+		return self.stored[content_hash]
+
+
+def fetch_images(urls, progress=None, resolver=None, targets=None, processor=None, prefetcher=None):
+	"""Return a dict mapping each distinct URL to its image content, or ``None`` if it failed."""
+	urls = [url for url in dict.fromkeys(urls) if url]
+	images = {}
+	if not urls:
+		return images
+	targets = targets or {}
+	if targets and not processor:
+		processor = ImageProcessor()
+	image_cache = RemoteImageCache()
+
+	def is_remote(url):
+		return not (resolver and resolver.get_path(url))
+
+	for url in urls:
+		if is_remote(url) and has_failed_recently(url):
+			images[url] = None
+			if progress:
+				progress.increment("images_failed")
+	pending = [url for url in urls if url not in images]
+	prefetched = {url: prefetcher.pop(url, targets.get(url)) for url in pending} if prefetcher else {}
+
+	workers = min(IMAGE_FETCH_WORKERS, len(pending)) or 1
+	with measure(progress, "images"), ThreadPoolExecutor(max_workers=workers) as executor:
+		futures = {}
+		for url in pending:
+			future = prefetched.get(url) or executor.submit(
+				fetch_image, url, resolver, targets.get(url), processor, image_cache
+			)
+			futures[future] = url
+		for future in as_completed(futures):
+			url = futures[future]
+			try:
+				images[url] = future.result()
+			except DownloadError as e:
+				images[url] = None
+				set_failed(url)
+				get_logger().warning(f"Failed to download image from {url}: {e}")
+			if progress:
+				progress.increment("images_fetched" if images[url] is not None else "images_failed")
+
+	if progress:
+		progress.metrics.add_bytes("images", sum(len(content) for content in images.values() if content))
+	return images
+
+
+class ImagePrefetcher:
+	"""Download images in the background, ahead of the portfolios that show them."""
+
+	# Downloads of chunks more than this many behind the latest one are dropped;
+	# by then they have been rendered, since loading runs one chunk ahead
+	keep_chunks = 3
+
+	def __init__(self, resolver=None, processor=None, limit=IMAGE_PREFETCH_LIMIT):
+		self.resolver = resolver
+		self.processor = processor or ImageProcessor()
+		self.image_cache = RemoteImageCache()
+		self.limit = limit
+		self.executor = ThreadPoolExecutor(max_workers=IMAGE_FETCH_WORKERS)
+		self.futures = {}  # (url, target) -> (chunk, future)
+		self.queued = {}  # (url, target) -> chunk, in order
+		self.seen = set()
+		self.chunk = 0
+		self.lock = threading.Lock()
+
+	def prefetch(self, targets):
+		"""Start downloading the URLs of ``targets`` (URL -> ``ImageTarget`` or ``None``)."""
+		with self.lock:
+			self.chunk += 1
+			oldest = self.chunk - self.keep_chunks
+			for key, (chunk, future) in list(self.futures.items()):
+				if chunk < oldest:
+					future.cancel()
+					del self.futures[key]
+			for key, chunk in list(self.queued.items()):
+				if chunk < oldest:
+					del self.queued[key]
+
+			for url, target in targets.items():
+				key = (url, target)
+				if not url or url.startswith("data:") or key in self.seen:
+					continue
+				self.seen.add(key)
+				if (self.resolver and self.resolver.get_path(url)) or not has_failed_recently(url):
+					self.queued[key] = self.chunk
+			self.start_queued()
+
+	def pop(self, url, target=None):
+		"""Return the download of ``url`` started for ``target``, or ``None``."""
+		with self.lock:
+			self.queued.pop((url, target), None)
+			_chunk, future = self.futures.pop((url, target), (None, None))
+			self.start_queued()
+		return future
+
+	def start_queued(self):
+		while self.queued and len(self.futures) < self.limit:
+			key = next(iter(self.queued))
+			chunk = self.queued.pop(key)
+			url, target = key
+			future = self.executor.submit(
+				fetch_image, url, self.resolver, target, self.processor, self.image_cache
+			)
+			self.futures[key] = (chunk, future)
+
+	def close(self):
+		with self.lock:
+			self.queued.clear()
+			for _chunk, future in self.futures.values():
+				future.cancel()
+			self.futures.clear()
+		self.executor.shutdown(wait=True)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+
+def fetch_image(url, resolver=None, target=None, processor=None, image_cache=None):
+	"""Return the content of ``url``, downscaled to ``target`` if one is given.
+
+	This runs in worker threads, which have no Frappe context, so ``resolver``,
+	``processor`` and ``image_cache`` must be created beforehand.
+	"""
+	if resolver and resolver.get_path(url):
+		content = resolver.read(url)
+	else:
+		content = (image_cache or RemoteImageCache()).fetch(url)
+		if content and get_image_type(content)[0] is None:
+			raise DownloadError("Not an image")
+	if content and target:
+		content = processor.process(content, target)
+	return content
@@ -0,0 +1,194 @@
+import re
+from html import unescape
+from urllib.parse import urljoin
+
+import frappe
+
+from portfolio.cache import get_cached_fragment
+from portfolio.image_processing import ImageTarget
+
+# What each layout shows for a portfolio is defined once here and consumed by
+# both the HTML templates (PDF/HTML exports) and the DOCX renderers.
+
+KARTOZA_ICONS = ("time", "location", "person", "footer")
+
+# Largest size, in pixels at 150 DPI, at which each format displays images
+DOCX_SCREENSHOT_IMAGE = ImageTarget(750, 1500)  # 5 inches wide
+DOCX_LOGO_IMAGE = ImageTarget(300, 300)  # 2 inches
+PDF_IMAGE = ImageTarget(1050, 1500)  # the width of an A4 page inside its margins
+HTML_IMAGE = ImageTarget(1200, 2400, allow_webp=True)
+
+# Comments, tags (whose quoted attributes may contain ">") and text of rich text
+TOKEN_PATTERN = re.compile(
+	r"<!--.*?-->|<(/?)([a-zA-Z][\w:-]*)((?:[^>\"']|\"[^\"]*\"|'[^']*')*)>|[^<]+|<", re.DOTALL
+)
+# URL attributes of a tag, with quoted or unquoted values
+URL_ATTRIBUTE_PATTERN = re.compile(
+	r"""(\s(src|href|srcset)\s*=\s*)(?:(["'])(.*?)\3|([^\s"'=<>`]+))""", re.IGNORECASE | re.DOTALL
+)
+ABSOLUTE_URL_PREFIXES = ("http:", "https:", "//", "data:", "mailto:", "tel:", "javascript:", "#")
+
+
+class RenderContext:
+	"""What every portfolio of one export is rendered with, worked out once.
+
+	Shared by all the portfolios and layout functions of the export, so the site
+	URL and the URLs of the layout's assets are not looked up per portfolio.
+	``portfolios`` holds the records loaded by the other targets of a
+	multi-target export (see ``SharedPortfolios``).
+	"""
+
+	def __init__(self, layout, base_url=None, portfolios=None):
+		self.layout = layout
+		self.base_url = base_url or frappe.utils.get_url()
+		self.icons = get_kartoza_icons(self.base_url)
+		self.portfolios = portfolios
+
+
+def get_kartoza_sheet(portfolio, context):
+	"""Return the content of a Kartoza project sheet for ``portfolio``."""
+	base_url = context.base_url
+	return frappe._dict(
+		title=portfolio.title,
+		client=portfolio.client,
+		location=portfolio.location,
+		period=f"{portfolio.start_date} - {portfolio.end_date}",
+		client_logo=get_absolute_url(portfolio.client_logo, base_url) if portfolio.client_logo else "",
+		client_reference=portfolio.client_reference if portfolio.client_reference else "Unavailable",
+		client_contact=portfolio.contact if portfolio.contact else "Unavailable",
+		icons=context.icons,
+		body=get_portfolio_body(portfolio, base_url),
+		images=[
+			get_absolute_url(image.website_image, base_url)
+			for image in portfolio.images
+			if image and image.website_image
+		],
+		services=[service.service for service in portfolio.services_listed],
+	)
+
+
+def get_kartoza_icons(base_url):
+	return frappe._dict({icon: f"{base_url}/assets/portfolio/images/{icon}.png" for icon in KARTOZA_ICONS})
+
+
+def get_image_urls(portfolio, context):
+	"""Return the URLs of the content images the layout shows for ``portfolio``, as rendered.
+
+	Layout icons are left out; they are bundled with the app and read from disk.
+	"""
+	if context.layout == "kartoza":
+		sheet = get_kartoza_sheet(portfolio, context)
+		return [sheet.client_logo, *sheet.images, *sheet.body.images]
+	return list(get_portfolio_body(portfolio, context.base_url).images)
+
+
+def get_worldbank_rows(details, context, text=False):
+	"""Return the ``(label, value)`` rows of a World Bank assignment form.
+
+	The project description is the normalised body, as HTML or, with ``text``,
+	as plain text.
+	"""
+	body = get_portfolio_body(details, context.base_url)
+	services = ", ".join(service.service for service in details.services_listed)
+	return [
+		("Assignment name:", details.title),
+		("Approx. value of the contract (in current US$):", details.approximate_contract_value),
+		("Country:", details.location),
+		("Duration of assignment (months):", details.duration_of_assignment),
+		("Name of Client(s):", details.client),
+		("Contact Person, Title/Designation, Tel. No./Address:", details.contact),
+		("Start Date (month/year):", details.start_date),
+		("End Date (month/year):", details.end_date),
+		("Total No. of staff-months of the assignment:", details.total_staff_months),
+		(
+			"No. of professional staff-months provided by your consulting firm/organization or your sub consultants:",
+			details.total_staff_months,
+		),
+		("Name of associated Consultants, if any:", ""),
+		(
+			"Name of senior professional staff of your consulting firm/organization involved and designation and/or functions performed:",
+			"",
+		),
+		("Description of Project:", body.text if text else body.html),
+		("Description of actual services provided by your staff within the assignment:", services),
+	]
+
+
+def get_absolute_url(url, base_url):
+	if url.startswith(("http://", "https://")):
+		return url
+	return base_url + url
+
+
+def get_portfolio_body(portfolio, base_url):
+	"""Return the normalised body of a portfolio revision, cached for every layout and format."""
+	return get_cached_fragment(
+		"body", portfolio, lambda portfolio: normalise_body(portfolio.body or "", base_url), variant=base_url
+	)
+
+
+def normalise_body(html_content, base_url):
+	"""Make the URLs of rich text absolute and extract its plain text in one pass.
+
+	Returns ``html`` with every relative ``src``, ``href`` and ``srcset`` URL
+	resolved against ``base_url``, the ``text`` without tags or entities, and
+	the ``images`` (``<img src>``) it refers to, in order.
+	"""
+	html = []
+	text = []
+	images = []
+
+	def replace_url(match):
+		prefix, attribute, quote, value, unquoted = match.groups()
+		if quote is None:
+			quote, value = '"', unquoted
+		if attribute.lower() == "srcset":
+			value = rewrite_srcset(value, base_url)
+		else:
+			value = get_absolute_url_or_none(value, base_url) or value
+		return f"{prefix}{quote}{value}{quote}"
+
+	for match in TOKEN_PATTERN.finditer(html_content):
+		token = match.group(0)
+		tag = match.group(2)
+		if tag is None:
+			html.append(token)
+			if not token.startswith("<!--"):
+				text.append(unescape(token))
+			continue
+
+		attributes = URL_ATTRIBUTE_PATTERN.sub(replace_url, match.group(3))
+		html.append(f"<{match.group(1)}{tag}{attributes}>")
+		if tag.lower() == "img":
+			# Every URL attribute is quoted once rewritten
+			src = next(
+				(
+					m.group(4)
+					for m in URL_ATTRIBUTE_PATTERN.finditer(attributes)
+					if m.group(2).lower() == "src"
+				),
+				None,
+			)
+			if src and not src.startswith("data:"):
+				images.append(src)
+
+	return frappe._dict(html="".join(html), text="".join(text), images=images)
+
+
+def get_absolute_url_or_none(url, base_url):
+	url = url.strip()
+	if not url or url.lower().startswith(ABSOLUTE_URL_PREFIXES):
+		return None
+	return urljoin(base_url, url)
+
+
+def rewrite_srcset(srcset, base_url):
+	# Data URIs contain commas of their own and need no rewriting
+	if "data:" in srcset:
+		return srcset
+	candidates = []
+	for candidate in srcset.split(","):
+		url, _, descriptor = candidate.strip().partition(" ")
+		url = get_absolute_url_or_none(url, base_url) or url
+		candidates.append(f"{url} {descriptor}".strip())
+	return ", ".join(candidates)
@@ -0,0 +1,124 @@
+from collections import deque
+
+import frappe
+from frappe import _
+
+from portfolio.metrics import measure
+
+# Portfolios are loaded this many at a time when streamed through an export
+PORTFOLIO_CHUNK_SIZE = 50
+# Chunks loaded, and their images prefetched, ahead of the one being exported
+PREFETCH_CHUNKS = 1
+
+
+def get_portfolio_names(filters, order_by=None):
+	"""Return the names of the Portfolios matching a Frappe filter spec.
+
+	``filters`` is what the list view sends (a dict or a list of filters),
+	including filters on child table fields such as technologies or services.
+	Only Portfolios the user can read are returned.
+	"""
+	return frappe.get_list(
+		"Portfolio",
+		filters=frappe.parse_json(filters) if filters else None,
+		order_by=order_by or "modified desc",
+		pluck="name",
+		limit_page_length=0,
+		distinct=True,
+	)
+
+
+def iter_portfolios(
+	portfolio_names, chunk_size=PORTFOLIO_CHUNK_SIZE, progress=None, prefetch=None, shared=None
+):
+	"""Yield Portfolio records in the requested order, loading ``chunk_size`` at a time."""
+	chunks = iter_portfolio_chunks(
+		portfolio_names, chunk_size, progress=progress, prefetch=prefetch, shared=shared
+	)
+	for portfolios in chunks:
+		yield from portfolios
+
+
+def iter_portfolio_chunks(
+	portfolio_names, chunk_size=PORTFOLIO_CHUNK_SIZE, progress=None, prefetch=None, shared=None
+):
+	"""Yield lists of at most ``chunk_size`` Portfolio records, in the requested order.
+
+	``prefetch`` is called with every chunk as soon as it is loaded, e.g. to start
+	downloading its images in the background. Chunks are then loaded
+	``PREFETCH_CHUNKS`` ahead of the one the caller works on, so their downloads
+	overlap its rendering while memory stays bounded. Records are always read on
+	the calling thread, in its database transaction. Chunks ``shared`` has
+	loaded already are taken from it.
+	"""
+	chunks = [
+		portfolio_names[start : start + chunk_size] for start in range(0, len(portfolio_names), chunk_size)
+	]
+	ahead = PREFETCH_CHUNKS if prefetch else 0
+	loaded = deque()
+	for chunk in chunks:
+		with measure(progress, "load"):
+			portfolios = shared.load(chunk) if shared else load_portfolios(chunk)
+		if prefetch:
+			prefetch(portfolios)
+		loaded.append(portfolios)
+		if len(loaded) > ahead:
+			yield loaded.popleft()
+	while loaded:
+		yield loaded.popleft()
+
+
+class SharedPortfolios:
+	"""Portfolio records loaded once and shared by every target of a multi-target export.
+
+	Targets read the selection in the same chunks, so each chunk is loaded by the
+	first target and kept for the others until the export is done.
+	"""
+
+	def __init__(self):
+		self.chunks = {}
+
+	def load(self, portfolio_names):
+		key = tuple(portfolio_names)
+		if key not in self.chunks:
+			self.chunks[key] = load_portfolios(portfolio_names)
+		return self.chunks[key]
+
+
+def load_portfolios(portfolio_names):
+	"""Load Portfolio records and their child tables in bulk.
+
+	Returns one ``frappe._dict`` per requested name, in the requested order, with
+	every child table (``technologies``, ``services_listed``, ``images``, ...)
+	attached as a list of rows. The number of queries depends only on the number
+	of table fields on Portfolio, not on the number of portfolios.
+	"""
+	names = list(dict.fromkeys(portfolio_names))
+	if not names:
+		return []
+
+	rows = frappe.get_all("Portfolio", filters={"name": ["in", names]}, fields=["*"])
+	records = {row.name: row for row in rows}
+
+	missing = [name for name in names if name not in records]
+	if missing:
+		frappe.throw(_("Portfolio {0} not found").format(", ".join(missing)), frappe.DoesNotExistError)
+
+	for table_field in frappe.get_meta("Portfolio").get_table_fields():
+		for record in records.values():
+			record[table_field.fieldname] = []
+
+		children = frappe.get_all(
+			table_field.options,
+			filters={
+				"parenttype": "Portfolio",
+				"parentfield": table_field.fieldname,
+				"parent": ["in", names],
+			},
+			fields=["*"],
+			order_by="idx asc",
+		)
+		for child in children:
+			records[child.parent][table_field.fieldname].append(child)
+
+	return [records[name] for name in portfolio_names]
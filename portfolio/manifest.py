@@ -0,0 +1,103 @@
+import json
+import os
+from functools import cached_property
+
+import frappe
+from frappe import _
+
+from portfolio.cache import get_cache_path, read_cache_file, write_cache_file
+from portfolio.export_files import get_export_version
+
+# Every export File gets a manifest of the portfolio revisions it contains and
+# where each one sits in the file (pages of a PDF, body elements of a DOCX,
+# bytes of the HTML page), so a later export can copy the unchanged ones over.
+
+
+def get_manifest_path(file_name):
+	return get_cache_path("manifests", f"{file_name}.json")
+
+
+class ExportManifest:
+	"""Which portfolio revisions an export File contains and where each one is."""
+
+	def __init__(self, format, layout, pdf_engine=None, portfolios=None, version=None):
+		self.format = format
+		self.layout = layout
+		self.pdf_engine = pdf_engine
+		self.portfolios = portfolios or []  # [name, modified, start, stop] in export order
+		self.version = get_export_version() if version is None else version
+
+	def record(self, portfolio, start=None, stop=None):
+		self.portfolios.append([portfolio.name, str(portfolio.modified), start, stop])
+
+	def find(self, portfolio):
+		"""Return the ``(start, stop)`` of ``portfolio`` if this revision is in the export."""
+		for name, modified, start, stop in self.portfolios:
+			if name == portfolio.name and modified == str(portfolio.modified) and start is not None:
+				return start, stop
+		return None
+
+	def save(self, file_name):
+		manifest = {
+			"format": self.format,
+			"layout": self.layout,
+			"pdf_engine": self.pdf_engine,
+			"portfolios": self.portfolios,
+			"version": self.version,
+		}
+		write_cache_file(get_manifest_path(file_name), json.dumps(manifest).encode())
+
+	@classmethod
+	def load(cls, file_name):
+		content = read_cache_file(get_manifest_path(file_name))
+		if not content:
+			return None
+		# Manifests from before versions were recorded never match the current one
+		return cls(**{"version": "", **json.loads(content)})
+
+
+class PreviousExport:
+	"""An earlier export File whose unchanged portfolios can be copied into a new one."""
+
+	def __init__(self, file_doc, manifest):
+		self.file_doc = file_doc
+		self.manifest = manifest
+
+	def find(self, portfolio):
+		return self.manifest.find(portfolio)
+
+	@cached_property
+	def path(self):
+		return self.file_doc.get_full_path()
+
+
+def get_previous_export(file_name, format, layout):
+	"""Return the export File ``file_name`` to build on, or ``None`` without a manifest.
+
+	Exports made before manifests were recorded, deleted since, or made by
+	another version of the export code simply get a full rebuild.
+	"""
+	if not frappe.db.exists("File", file_name):
+		return None
+	file_doc = frappe.get_doc("File", file_name)
+	file_doc.check_permission("read")
+	manifest = ExportManifest.load(file_doc.name)
+	if not manifest or not os.path.exists(file_doc.get_full_path()):
+		return None
+	if (manifest.format, manifest.layout) != (format, layout):
+		frappe.throw(
+			_("The previous export is a {0} export in the {1} layout").format(
+				manifest.format, manifest.layout
+			)
+		)
+	if manifest.version != get_export_version():
+		return None
+	return PreviousExport(file_doc, manifest)
+
+
+def remove_manifest(doc, method=None):
+	"""Drop the manifest of an export File when the File is deleted."""
+	try:
+		os.remove(get_manifest_path(doc.name))
+	except FileNotFoundError:
+		pass
@@ -0,0 +1,113 @@
+import json
+import time
+from contextlib import contextmanager, nullcontext
+
+import frappe
+
+# The most recent export records are kept in Redis for the stats endpoint; the
+# full history is in the `portfolio_export` log file.
+EXPORT_METRICS_KEY = "portfolio_export_metrics"
+EXPORT_METRICS_KEEP = 200
+
+
+def get_logger():
+	return frappe.logger("portfolio_export", allow_site=True)
+
+
+def measure(progress, stage):
+	"""Time ``stage`` on the export's metrics, or do nothing without a progress tracker."""
+	return progress.metrics.measure(stage) if progress else nullcontext()
+
+
+class ExportMetrics:
+	"""Durations, query counts and bytes of every stage of one export.
+
+	Stages may be entered several times (e.g. once per portfolio) and are summed.
+	They can also nest, such as rendering inside zipping for HTML exports, in
+	which case the outer stage includes the inner one.
+	"""
+
+	def __init__(self):
+		self.stages = {}
+		self.seconds = None
+		self.queries = None
+		self._query_counter = None
+
+	@contextmanager
+	def track(self, counters, **context):
+		"""Measure a whole export and log its record once it finishes or fails."""
+		start = time.perf_counter()
+		status = "failed"
+		with count_queries() as query_counter:
+			self._query_counter = query_counter
+			try:
+				yield self
+				status = "success"
+			finally:
+				self.seconds = round(time.perf_counter() - start, 3)
+				self.queries = query_counter["count"]
+				self._query_counter = None
+				self.log({"status": status, **context, **counters})
+
+	@contextmanager
+	def measure(self, stage):
+		start = time.perf_counter()
+		queries = self._query_counter["count"] if self._query_counter else 0
+		try:
+			yield
+		finally:
+			values = self.stages.setdefault(stage, {"seconds": 0, "queries": 0, "calls": 0, "bytes": 0})
+			values["seconds"] = round(values["seconds"] + time.perf_counter() - start, 3)
+			values["queries"] += (self._query_counter["count"] if self._query_counter else 0) - queries
+			values["calls"] += 1
+
+	def add_bytes(self, stage, size):
+		values = self.stages.setdefault(stage, {"seconds": 0, "queries": 0, "calls": 0, "bytes": 0})
+		values["bytes"] += size
+
+	def log(self, context):
+		record = {
+			"timestamp": frappe.utils.now(),
+			**context,
+			"seconds": self.seconds,
+			"queries": self.queries,
+			"stages": self.stages,
+		}
+		record = json.dumps(record, default=str)
+		get_logger().info(record)
+		try:
+			frappe.cache().lpush(EXPORT_METRICS_KEY, record)
+			frappe.cache().ltrim(EXPORT_METRICS_KEY, 0, EXPORT_METRICS_KEEP - 1)
+		except Exception:
+			# Metrics must never fail an export
+			get_logger().exception("Could not store portfolio export metrics")
+
+
+def get_recent_metrics(limit=20):
+	records = frappe.cache().lrange(EXPORT_METRICS_KEY, 0, limit - 1) or []
+	return [json.loads(record) for record in records]
+
+
+@contextmanager
+def count_queries():
+	"""Count the queries run through ``frappe.db.sql`` in the enclosed block.
+
+	Nested counters are supported; each one restores whatever it replaced.
+	"""
+	db = frappe.local.db
+	counter = {"count": 0}
+	previous = db.__dict__.get("sql")
+	sql = db.sql
+
+	def counting_sql(*args, **kwargs):
+		counter["count"] += 1
+		return sql(*args, **kwargs)
+
+	db.sql = counting_sql
+	try:
+		yield counter
+	finally:
+		if previous is None:
+			del db.sql
+		else:
+			db.sql = previous
@@ -0,0 +1,89 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import frappe
+from frappe.utils.pdf import get_pdf
+from pypdf import PdfReader, PdfWriter
+
+# wkhtmltopdf runs as a child process, so a thread per page is enough to keep
+# every core busy without forking the worker along with its DB connection.
+# Sites can lower or raise the count with the `portfolio_pdf_workers` config.
+MAX_PDF_WORKERS = 8
+
+
+def get_pdf_workers():
+	return frappe.utils.cint(frappe.conf.get("portfolio_pdf_workers")) or min(
+		os.cpu_count() or 1, MAX_PDF_WORKERS
+	)
+
+
+class PdfRenderer:
+	"""Render HTML documents to PDF on a pool of worker threads.
+
+	Each worker opens a Frappe context for the site once, in the executor's
+	initializer, and keeps it for every document it renders; their database
+	connections are closed with the renderer.
+	"""
+
+	def __init__(self, workers=None):
+		self.workers = workers or get_pdf_workers()
+		self.connections = []
+		self.executor = ThreadPoolExecutor(
+			max_workers=self.workers,
+			initializer=init_pdf_worker,
+			initargs=(frappe.local.site, frappe.local.sites_path, self.connections),
+		)
+
+	def render(self, documents):
+		"""Render HTML documents to PDF concurrently, returning the PDFs in order."""
+		if len(documents) <= 1:
+			return [get_pdf(html) for html in documents]
+		return list(self.executor.map(get_pdf, documents))
+
+	def close(self):
+		self.executor.shutdown(wait=True)
+		for db in self.connections:
+			db.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+
+def init_pdf_worker(site, sites_path, connections):
+	"""Give a worker thread, which has no Frappe context of its own, one for ``site``."""
+	frappe.init(site=site, sites_path=sites_path)
+	frappe.connect()
+	connections.append(frappe.local.db)
+
+
+def merge_pdfs(pdfs, output=None, page_counts=None):
+	"""Concatenate PDF documents into one, written to ``output`` or returned as bytes.
+
+	Items are PDF bytes or paths, or ``(pdf, (start, stop))`` to copy only a page
+	range; each path is parsed once however many items refer to it. When a
+	``page_counts`` list is given, the number of pages taken from each item is
+	appended to it.
+	"""
+	writer = PdfWriter()
+	readers = {}
+	for pdf in pdfs:
+		pdf, pages = pdf if isinstance(pdf, tuple) else (pdf, None)
+		if isinstance(pdf, bytes):
+			reader = PdfReader(io.BytesIO(pdf))
+		else:
+			reader = readers.get(pdf) or readers.setdefault(pdf, PdfReader(pdf))
+		start = len(writer.pages)
+		writer.append(reader, pages=pages)
+		if page_counts is not None:
+			page_counts.append(len(writer.pages) - start)
+
+	if output is not None:
+		writer.write(output)
+		return None
+	output = io.BytesIO()
+	writer.write(output)
+	return output.getvalue()
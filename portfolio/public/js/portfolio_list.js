@@ -2,18 +2,31 @@ frappe.listview_settings['Portfolio'] = {
     onload: function(listview) {
         console.log("Portfolio list view loaded");
 
+        frappe.realtime.off('portfolio_export_progress', handle_export_progress);
+        frappe.realtime.on('portfolio_export_progress', handle_export_progress);
+
         listview.page.add_action_item(__('Export Portfolio'), function() {
             let selected = listview.get_checked_items();
             if (selected.length > 0) {
-                show_export_dialog(selected);
+                show_export_dialog({
+                    portfolio_names: JSON.stringify(selected.map(item => item.name))
+                });
             } else {
                 frappe.msgprint(__('Please select at least one portfolio.'));
             }
         });
+
+        // Matching portfolios are resolved on the server, however many there are
+        listview.page.add_menu_item(__('Export All Matching Portfolios'), function() {
+            show_export_dialog({
+                filters: JSON.stringify(listview.get_filters_for_args()),
+                order_by: listview.sort_by + ' ' + listview.sort_order
+            });
+        });
     }
 };
 
-function show_export_dialog(selected) {
+function show_export_dialog(selection) {
     let d = new frappe.ui.Dialog({
         title: __('Choose Export Format and Layout'),
         fields: [
@@ -46,30 +59,94 @@ function show_export_dialog(selected) {
                 fieldname: 'include_sensitive',
                 fieldtype: 'Check',
                 default: 0
+            },
+            {
+                label: __('Run in Background'),
+                fieldname: 'async_export',
+                fieldtype: 'Check',
+                default: 1
+            },
+            {
+                label: __('Also Export As'),
+                fieldname: 'extra_targets',
+                fieldtype: 'MultiCheck',
+                columns: 2,
+                options: [
+                    { label: 'PDF - Kartoza', value: 'pdf|kartoza' },
+                    { label: 'PDF - World Bank', value: 'pdf|world bank' },
+                    { label: 'DOCX - Kartoza', value: 'docx|kartoza' },
+                    { label: 'DOCX - World Bank', value: 'docx|world bank' },
+                    { label: 'HTML - Kartoza', value: 'html|kartoza' },
+                    { label: 'HTML - World Bank', value: 'html|world bank' },
+                ],
+                description: __('Every format and layout is exported in one job and downloaded as a single ZIP file.')
+            },
+            {
+                label: __('Only Re-render Changed Portfolios'),
+                fieldname: 'reuse_previous',
+                fieldtype: 'Check',
+                default: 1,
+                description: __('Copies unchanged portfolios from your last export in the same format and layout.')
             }
         ],
         primary_action_label: __('Export'),
         primary_action: function(data) {
             d.hide();
-            export_portfolios(selected, data.format, data.layout, data.include_sensitive);
+            let format = data.format;
+            let layout = data.layout;
+            let previous_export = data.reuse_previous ? get_last_export(format, layout) : null;
+            let extra_targets = (data.extra_targets || [])
+                .map(value => value.split('|'))
+                .filter(([extra_format, extra_layout]) => extra_format !== format || extra_layout !== layout);
+            let args = selection;
+            if (extra_targets.length) {
+                args = Object.assign({}, selection, {
+                    targets: JSON.stringify([[format, layout], ...extra_targets])
+                });
+                // The ZIP has no manifest, so it is not remembered as the last export of any format and layout
+                format = layout = previous_export = null;
+            }
+            export_portfolios(args, format, layout, data.include_sensitive, data.async_export, previous_export);
         }
     });
 
     d.show();
 }
 
-function export_portfolios(selected, format, layout, include_sensitive) {
+// Background exports currently being followed by this page, keyed by job id
+let pending_exports = {};
+
+// The last export File of each format and layout, which the next export can build on
+function get_last_export(format, layout) {
+    return localStorage.getItem('portfolio_last_export|' + format + '|' + layout);
+}
+
+function set_last_export(format, layout, file_name) {
+    if (file_name && format && layout) {
+        localStorage.setItem('portfolio_last_export|' + format + '|' + layout, file_name);
+    }
+}
+
+// `selection` holds either the `portfolio_names` or the `filters` and `order_by` to export
+function export_portfolios(selection, format, layout, include_sensitive, async_export, previous_export) {
     console.log(format, layout);
     frappe.call({
         method: 'portfolio.export.export_portfolio',
         args: {
-            portfolio_names: JSON.stringify(selected.map(item => item.name)),
+            ...selection,
             format: format,
             layout: layout,
-            include_sensitive: include_sensitive
+            include_sensitive: include_sensitive,
+            async_export: async_export,
+            previous_export: previous_export
         },
         callback: function(r) {
-            if (r.message.status === 'success') {
+            if (r.message.status === 'queued') {
+                pending_exports[r.message.job_id] = { format: format, layout: layout };
+                frappe.show_alert({ message: __('Export started in the background.'), indicator: 'blue' });
+                poll_export_status(r.message.job_id);
+            } else if (r.message.status === 'success') {
+                set_last_export(format, layout, r.message.file_name);
                 window.open(r.message.file_url, '_blank');
             } else {
                 frappe.msgprint(__('Failed to export portfolio' + r.message.message));
@@ -77,3 +154,50 @@ function export_portfolios(selected, format, layout, include_sensitive) {
         }
     });
 }
+
+function handle_export_progress(data) {
+    if (!pending_exports[data.job_id]) {
+        return;
+    }
+
+    if (data.status === 'success') {
+        let pending = pending_exports[data.job_id];
+        set_last_export(pending.format, pending.layout, data.file_name);
+        delete pending_exports[data.job_id];
+        frappe.hide_progress();
+        frappe.show_alert({ message: __('Portfolios exported successfully.'), indicator: 'green' });
+        window.open(data.file_url, '_blank');
+    } else if (data.status === 'failed') {
+        delete pending_exports[data.job_id];
+        frappe.hide_progress();
+        frappe.msgprint(__('Failed to export portfolio: ') + data.message);
+    } else if (data.status === 'unknown') {
+        // The status expired without the job finishing, e.g. its worker was killed
+        delete pending_exports[data.job_id];
+        frappe.hide_progress();
+        frappe.msgprint(__('The export stopped without finishing. Please try again.'));
+    } else {
+        let description = __('{0} of {1} portfolios rendered, {2} images fetched', [
+            data.rendered, data.total, data.images_fetched
+        ]);
+        frappe.show_progress(__('Exporting Portfolios'), data.rendered, data.total, description);
+    }
+}
+
+// Realtime events can be missed (e.g. the job finishes before the socket
+// subscribes), so the stored status is polled until the export settles.
+function poll_export_status(job_id) {
+    setTimeout(function() {
+        if (!pending_exports[job_id]) {
+            return;
+        }
+        frappe.call({
+            method: 'portfolio.export.get_export_status',
+            args: { job_id: job_id },
+            callback: function(r) {
+                handle_export_progress(r.message);
+                poll_export_status(job_id);
+            }
+        });
+    }, 5000);
+}
@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from portfolio.cache import (
+	evict_cache_files,
+	get_page_cache_path,
+	read_cache_file,
+	touch_cache_file,
+	write_cache_file,
+)
+
+
+class TestCacheFiles(FrappeTestCase):
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.folder)
+
+	def test_write_and_read(self):
+		path = os.path.join(self.folder, "ab", "file")
+		self.assertIsNone(read_cache_file(path))
+		write_cache_file(path, b"content")
+		self.assertEqual(read_cache_file(path), b"content")
+
+	def test_threads_can_write_the_same_path_at_once(self):
+		path = os.path.join(self.folder, "ab", "file")
+		contents = [bytes([i]) * 1024 for i in range(8)]
+
+		with ThreadPoolExecutor(max_workers=4) as executor:
+			list(executor.map(lambda i: write_cache_file(path, contents[i % 8]), range(400)))
+
+		self.assertIn(read_cache_file(path), contents)
+		self.assertEqual(os.listdir(os.path.dirname(path)), ["file"])
+
+	def test_evicts_least_recently_used_files_first(self):
+		paths = [os.path.join(self.folder, "ab", name) for name in ("old", "used", "new")]
+		for age, path in zip((300, 200, 100), paths, strict=True):
+			write_cache_file(path, b"x" * 100)
+			write_cache_file(f"{path}.json", b"{}")
+			os.utime(path, (os.path.getmtime(path) - age,) * 2)
+		self.assertTrue(touch_cache_file(paths[1]))
+
+		evict_cache_files(self.folder, 200)
+
+		self.assertEqual(
+			sorted(os.listdir(os.path.join(self.folder, "ab"))), ["new", "new.json", "used", "used.json"]
+		)
+
+	def test_touching_a_missing_file(self):
+		self.assertFalse(touch_cache_file(os.path.join(self.folder, "missing")))
+
+
+class TestPageCachePath(FrappeTestCase):
+	def test_pages_with_private_images_are_kept_apart(self):
+		portfolio = frappe._dict(name="P1", modified="2024-01-01 00:00:00")
+		public = get_page_cache_path("kartoza", "pdf", portfolio)
+		private = get_page_cache_path("kartoza", "pdf", portfolio, ["/private/files/a.png"])
+
+		self.assertNotEqual(public, private)
+		self.assertEqual(os.path.dirname(public), os.path.dirname(private))
+		self.assertEqual(private, get_page_cache_path("kartoza", "pdf", portfolio, ("/private/files/a.png",)))
@@ -0,0 +1,69 @@
+import shutil
+import tempfile
+from unittest.mock import MagicMock, patch
+
+from frappe.tests.utils import FrappeTestCase
+
+from portfolio.fetch import DownloadError
+from portfolio.image_cache import RemoteImageCache
+
+URL = "https://images.test/logo.png"
+
+
+def make_response(status_code=200, headers=None):
+	response = MagicMock()
+	response.status_code = status_code
+	response.headers = headers or {}
+	return response
+
+
+class TestRemoteImageCache(FrappeTestCase):
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.folder)
+		patcher = patch("portfolio.image_cache.download")
+		self.download = patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def fill(self, cache):
+		self.download.return_value = (make_response(headers={"ETag": '"v1"'}), b"image")
+		self.assertEqual(cache.fetch(URL), b"image")
+		self.download.reset_mock()
+
+	def test_fresh_images_are_not_requested_again(self):
+		cache = RemoteImageCache(self.folder, ttl=60)
+		self.fill(cache)
+
+		self.assertEqual(cache.fetch(URL), b"image")
+		self.download.assert_not_called()
+
+	def test_stale_images_are_revalidated(self):
+		cache = RemoteImageCache(self.folder, ttl=0)
+		self.fill(cache)
+		self.download.return_value = (make_response(304), b"")
+
+		self.assertEqual(cache.fetch(URL), b"image")
+		self.download.assert_called_once_with(URL, headers={"If-None-Match": '"v1"'})
+
+	def test_changed_images_replace_the_cached_copy(self):
+		cache = RemoteImageCache(self.folder, ttl=0)
+		self.fill(cache)
+		self.download.return_value = (make_response(headers={"ETag": '"v2"'}), b"new image")
+
+		self.assertEqual(cache.fetch(URL), b"new image")
+		self.download.return_value = (make_response(304), b"")
+		self.assertEqual(cache.fetch(URL), b"new image")
+		self.download.assert_called_with(URL, headers={"If-None-Match": '"v2"'})
+
+	def test_stale_copy_is_used_when_revalidation_fails(self):
+		cache = RemoteImageCache(self.folder, ttl=0)
+		self.fill(cache)
+		self.download.side_effect = DownloadError("HTTP 503")
+
+		self.assertEqual(cache.fetch(URL), b"image")
+
+	def test_download_errors_without_a_cached_copy_are_raised(self):
+		self.download.side_effect = DownloadError("HTTP 503")
+
+		with self.assertRaises(DownloadError):
+			RemoteImageCache(self.folder, ttl=60).fetch(URL)
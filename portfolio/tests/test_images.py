@@ -0,0 +1,178 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+from unittest.mock import MagicMock, patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from PIL import Image
+
+from portfolio.fetch import DownloadError
+from portfolio.images import ImagePrefetcher, LocalAssetResolver, fetch_image, inline_local_images
+
+
+def make_png():
+	output = io.BytesIO()
+	Image.new("RGB", (2, 2), "red").save(output, "PNG")
+	return output.getvalue()
+
+
+class TestLocalAssetResolver(FrappeTestCase):
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.folder)
+		self.public = self.make_folder("public")
+		self.private = self.make_folder("private")
+		self.resolver = LocalAssetResolver("http://portfolio.test")
+		self.resolver.roots = {"/files/": self.public, "/private/files/": self.private}
+
+		self.png = make_png()
+		self.write(self.public, "logo.png", self.png)
+		self.write(self.private, "payslip.png", self.png)
+
+	def make_folder(self, name):
+		path = os.path.join(self.folder, name)
+		os.makedirs(path)
+		return os.path.realpath(path)
+
+	def write(self, folder, name, content):
+		with open(os.path.join(folder, name), "wb") as f:
+			f.write(content)
+
+	def test_resolves_relative_and_site_urls(self):
+		path = os.path.join(self.public, "logo.png")
+		self.assertEqual(self.resolver.get_path("/files/logo.png"), path)
+		self.assertEqual(self.resolver.get_path("http://portfolio.test/files/logo.png"), path)
+		self.assertIsNone(self.resolver.get_path("https://elsewhere.test/files/logo.png"))
+		self.assertIsNone(self.resolver.get_path("//elsewhere.test/files/logo.png"))
+
+	def test_refuses_paths_escaping_the_root(self):
+		self.assertIsNone(self.resolver.get_path("/files/../private/payslip.png"))
+		self.assertIsNone(self.resolver.get_path("/files/%2e%2e/private/payslip.png"))
+
+	def test_refuses_symlinks_escaping_the_root(self):
+		os.symlink(os.path.join(self.private, "payslip.png"), os.path.join(self.public, "link.png"))
+		self.assertIsNone(self.resolver.get_path("/files/link.png"))
+
+	def test_private_files_need_read_permission(self):
+		with patch.object(frappe, "get_all", return_value=["payslip"]), patch.object(
+			frappe, "has_permission", return_value=False
+		) as has_permission:
+			self.assertIsNone(self.resolver.get_path("/private/files/payslip.png"))
+			self.assertIsNone(self.resolver.read("/private/files/payslip.png"))
+		has_permission.assert_called_with("File", "read", doc="payslip")
+
+		resolver = LocalAssetResolver("http://portfolio.test")
+		resolver.roots = self.resolver.roots
+		with patch.object(frappe, "get_all", return_value=["payslip"]), patch.object(
+			frappe, "has_permission", return_value=True
+		):
+			self.assertEqual(resolver.read("/private/files/payslip.png"), self.png)
+
+	def test_private_urls_the_user_can_read(self):
+		urls = ["/files/logo.png", "/private/files/payslip.png", "https://elsewhere.test/a.png"]
+		with patch.object(frappe, "get_all", return_value=["payslip"]), patch.object(
+			frappe, "has_permission", return_value=True
+		):
+			self.assertEqual(self.resolver.get_private_urls(urls), ["/private/files/payslip.png"])
+
+		resolver = LocalAssetResolver("http://portfolio.test")
+		resolver.roots = self.resolver.roots
+		with patch.object(frappe, "get_all", return_value=["payslip"]), patch.object(
+			frappe, "has_permission", return_value=False
+		):
+			self.assertEqual(resolver.get_private_urls(urls), [])
+
+	def test_private_files_without_a_file_record_are_refused(self):
+		with patch.object(frappe, "get_all", return_value=[]):
+			self.assertIsNone(self.resolver.get_path("/private/files/payslip.png"))
+
+	def test_private_files_not_checked_are_refused_in_worker_threads(self):
+		paths = []
+		thread = threading.Thread(
+			target=lambda: paths.append(self.resolver.get_path("/private/files/payslip.png"))
+		)
+		thread.start()
+		thread.join()
+		self.assertEqual(paths, [None])
+
+	def test_uploaded_files_that_are_not_images_are_not_inlined(self):
+		self.write(self.public, "notes.png", b"account number 1234")
+		html = '<img src="/files/notes.png"><img src="/files/logo.png">'
+
+		inlined = inline_local_images(html, self.resolver)
+
+		self.assertIn('src="/files/notes.png"', inlined)
+		self.assertNotIn("/files/logo.png", inlined)
+		self.assertIsNone(self.resolver.read("/files/notes.png"))
+		self.assertIsNone(fetch_image("/files/notes.png", self.resolver))
+
+
+class TestFetchImage(FrappeTestCase):
+	def test_remote_content_that_is_not_an_image_is_rejected(self):
+		image_cache = MagicMock()
+		image_cache.fetch.return_value = b"<html>Not found</html>"
+		with self.assertRaises(DownloadError):
+			fetch_image("https://images.test/missing.png", image_cache=image_cache)
+
+	def test_remote_images_are_returned(self):
+		image_cache = MagicMock()
+		image_cache.fetch.return_value = png = make_png()
+		self.assertEqual(fetch_image("https://images.test/logo.png", image_cache=image_cache), png)
+
+
+class TestImagePrefetcher(FrappeTestCase):
+	def setUp(self):
+		self.release = threading.Event()
+		for target, kwargs in (
+			("portfolio.images.fetch_image", {"side_effect": self.fetch_image}),
+			("portfolio.images.has_failed_recently", {"return_value": False}),
+			("portfolio.images.RemoteImageCache", {}),
+		):
+			patcher = patch(target, **kwargs)
+			patcher.start()
+			self.addCleanup(patcher.stop)
+
+	def fetch_image(self, url, *args):
+		self.release.wait(5)
+		return url.encode()
+
+	def make_prefetcher(self, limit):
+		prefetcher = ImagePrefetcher(processor=MagicMock(), limit=limit)
+		self.addCleanup(prefetcher.close)
+		# Cleanups run last in, first out: let blocked downloads finish before closing
+		self.addCleanup(self.release.set)
+		return prefetcher
+
+	def test_downloads_beyond_the_limit_wait_until_earlier_ones_are_collected(self):
+		prefetcher = self.make_prefetcher(limit=2)
+		prefetcher.prefetch(dict.fromkeys(["/a.png", "/b.png", "/c.png"]))
+
+		self.assertEqual(len(prefetcher.futures), 2)
+		self.assertEqual(list(prefetcher.queued), [("/c.png", None)])
+
+		self.release.set()
+		self.assertEqual(prefetcher.pop("/a.png").result(), b"/a.png")
+		self.assertEqual(len(prefetcher.futures), 2)
+		self.assertFalse(prefetcher.queued)
+		self.assertEqual(prefetcher.pop("/c.png").result(), b"/c.png")
+
+	def test_images_are_prefetched_once(self):
+		prefetcher = self.make_prefetcher(limit=10)
+		prefetcher.prefetch({"/a.png": None, "data:image/png;base64,AA": None})
+		prefetcher.prefetch({"/a.png": None})
+
+		self.assertEqual(list(prefetcher.futures), [("/a.png", None)])
+
+	def test_downloads_of_rendered_chunks_are_dropped(self):
+		prefetcher = self.make_prefetcher(limit=1)
+		prefetcher.prefetch(dict.fromkeys(["/a.png", "/b.png"]))
+		for chunk in range(ImagePrefetcher.keep_chunks + 1):
+			self.assertIn(("/a.png", None), prefetcher.futures)
+			prefetcher.prefetch({f"/{chunk}.png": None})
+
+		self.assertNotIn(("/a.png", None), prefetcher.futures)
+		self.assertNotIn(("/b.png", None), prefetcher.queued)
+		self.assertIsNone(prefetcher.pop("/a.png"))
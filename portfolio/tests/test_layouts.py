@@ -0,0 +1,52 @@
+from frappe.tests.utils import FrappeTestCase
+
+from portfolio.layouts import normalise_body
+
+BASE_URL = "http://portfolio.test"
+
+
+class TestNormaliseBody(FrappeTestCase):
+	def test_makes_relative_urls_absolute(self):
+		body = normalise_body("<p><a href=\"/about\">About</a> <img src='/files/a.png'></p>", BASE_URL)
+
+		self.assertEqual(
+			body.html,
+			"<p><a href=\"http://portfolio.test/about\">About</a> <img src='http://portfolio.test/files/a.png'></p>",
+		)
+		self.assertEqual(body.text, "About ")
+		self.assertEqual(body.images, ["http://portfolio.test/files/a.png"])
+
+	def test_unquoted_attributes(self):
+		body = normalise_body("<IMG SRC=/files/c.png alt=c>", BASE_URL)
+
+		self.assertEqual(body.html, '<IMG SRC="http://portfolio.test/files/c.png" alt=c>')
+		self.assertEqual(body.images, ["http://portfolio.test/files/c.png"])
+
+	def test_srcset(self):
+		body = normalise_body('<img src="/a.png" srcset="/a.png 1x, https://cdn.test/a2.png 2x">', BASE_URL)
+
+		self.assertIn('srcset="http://portfolio.test/a.png 1x, https://cdn.test/a2.png 2x"', body.html)
+		self.assertEqual(body.images, ["http://portfolio.test/a.png"])
+
+	def test_data_uris_are_kept_and_not_collected(self):
+		html = '<img src="data:image/png;base64,AAAA" srcset="data:image/png;base64,AA,AA 2x">'
+		body = normalise_body(html, BASE_URL)
+
+		self.assertEqual(body.html, html)
+		self.assertEqual(body.images, [])
+
+	def test_quoted_angle_bracket_in_attribute(self):
+		body = normalise_body('<img alt="a > b" src="/files/d.png">caption &amp; more', BASE_URL)
+
+		self.assertEqual(
+			body.html, '<img alt="a > b" src="http://portfolio.test/files/d.png">caption &amp; more'
+		)
+		self.assertEqual(body.text, "caption & more")
+		self.assertEqual(body.images, ["http://portfolio.test/files/d.png"])
+
+	def test_other_attributes_are_left_alone(self):
+		html = '<img data-src="/lazy.png"><a href="mailto:a@b.test">mail</a><a href="#top">top</a>'
+		body = normalise_body(html, BASE_URL)
+
+		self.assertEqual(body.html, html)
+		self.assertEqual(body.images, [])
@@ -0,0 +1,58 @@
+import threading
+from unittest.mock import patch
+
+from frappe.tests.utils import FrappeTestCase
+
+from portfolio.loader import SharedPortfolios, iter_portfolio_chunks, iter_portfolios
+
+
+class TestIterPortfolioChunks(FrappeTestCase):
+	def setUp(self):
+		self.events = []
+		patcher = patch("portfolio.loader.load_portfolios", side_effect=self.load_portfolios)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def load_portfolios(self, names):
+		self.assertIs(threading.current_thread(), threading.main_thread())
+		self.events.append(("load", list(names)))
+		return list(names)
+
+	def test_loads_one_chunk_ahead_when_prefetching(self):
+		def prefetch(portfolios):
+			self.events.append(("prefetch", portfolios))
+
+		for chunk in iter_portfolio_chunks(["a", "b", "c", "d", "e"], chunk_size=2, prefetch=prefetch):
+			self.events.append(("export", chunk))
+
+		self.assertEqual(
+			self.events,
+			[
+				("load", ["a", "b"]),
+				("prefetch", ["a", "b"]),
+				("load", ["c", "d"]),
+				("prefetch", ["c", "d"]),
+				("export", ["a", "b"]),
+				("load", ["e"]),
+				("prefetch", ["e"]),
+				("export", ["c", "d"]),
+				("export", ["e"]),
+			],
+		)
+
+	def test_loads_on_demand_without_prefetch(self):
+		for chunk in iter_portfolio_chunks(["a", "b", "c"], chunk_size=2):
+			self.events.append(("export", chunk))
+
+		self.assertEqual(
+			self.events,
+			[("load", ["a", "b"]), ("export", ["a", "b"]), ("load", ["c"]), ("export", ["c"])],
+		)
+
+	def test_shared_chunks_are_loaded_once(self):
+		shared = SharedPortfolios()
+		first = list(iter_portfolios(["a", "b", "c"], chunk_size=2, shared=shared))
+		second = list(iter_portfolios(["a", "b", "c"], chunk_size=2, shared=shared))
+
+		self.assertEqual(first, second)
+		self.assertEqual(self.events, [("load", ["a", "b"]), ("load", ["c"])])
@@ -0,0 +1,146 @@
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+from unittest.mock import MagicMock, patch
+
+import frappe
+from docx import Document
+from frappe.tests.utils import FrappeTestCase
+from PIL import Image
+from pypdf import PdfReader, PdfWriter
+
+from portfolio.export import (
+	copy_docx_elements,
+	export_html_bundle,
+	get_bundle_html_name,
+	get_docx_body_length,
+)
+from portfolio.images import LocalAssetResolver
+from portfolio.layouts import RenderContext
+from portfolio.manifest import ExportManifest, PreviousExport, get_previous_export
+from portfolio.pdf import merge_pdfs
+
+
+def make_portfolio(name, modified="2024-01-01 00:00:00"):
+	return frappe._dict(name=name, modified=modified)
+
+
+def make_previous(path, manifest):
+	file_doc = MagicMock()
+	file_doc.get_full_path.return_value = path
+	return PreviousExport(file_doc, manifest)
+
+
+class TestExportManifest(FrappeTestCase):
+	def test_finds_recorded_revisions_only(self):
+		manifest = ExportManifest("pdf", "kartoza")
+		manifest.record(make_portfolio("P1"), 0, 2)
+		manifest.record(make_portfolio("P2"))
+
+		self.assertEqual(manifest.find(make_portfolio("P1")), (0, 2))
+		self.assertIsNone(manifest.find(make_portfolio("P1", "2024-02-01 00:00:00")))
+		self.assertIsNone(manifest.find(make_portfolio("P2")))
+
+	def test_exports_of_another_version_are_rebuilt(self):
+		manifest = ExportManifest("pdf", "kartoza", version="old")
+		file_doc = MagicMock()
+		file_doc.name = "export"
+		file_doc.get_full_path.return_value = __file__
+		with patch("portfolio.manifest.frappe.db") as db, patch.object(
+			frappe, "get_doc", return_value=file_doc
+		), patch.object(ExportManifest, "load", return_value=manifest):
+			db.exists.return_value = True
+			self.assertIsNone(get_previous_export("export", "pdf", "kartoza"))
+
+			manifest.version = ExportManifest("pdf", "kartoza").version
+			self.assertIs(get_previous_export("export", "pdf", "kartoza").manifest, manifest)
+
+
+class TestSplicing(FrappeTestCase):
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.folder)
+
+	def test_pdf_page_ranges(self):
+		previous = os.path.join(self.folder, "previous.pdf")
+		writer = PdfWriter()
+		for width in (100, 200, 300):
+			writer.add_blank_page(width, 100)
+		writer.write(previous)
+		page = PdfWriter()
+		page.add_blank_page(400, 100)
+		rendered = io.BytesIO()
+		page.write(rendered)
+
+		page_counts = []
+		merged = merge_pdfs(
+			[(previous, (1, 3)), rendered.getvalue(), (previous, (0, 1))], page_counts=page_counts
+		)
+
+		widths = [page.mediabox.width for page in PdfReader(io.BytesIO(merged)).pages]
+		self.assertEqual(widths, [200, 300, 400, 100])
+		self.assertEqual(page_counts, [2, 1, 1])
+
+	def test_docx_element_ranges(self):
+		source = Document()
+		source.add_paragraph("P1")
+		image = io.BytesIO()
+		Image.new("RGB", (2, 2), "red").save(image, "PNG")
+		source.add_picture(image)
+		source.add_paragraph("P2")
+		self.assertEqual(get_docx_body_length(source), 3)
+
+		document = Document()
+		document.add_paragraph("Title")
+		copy_docx_elements(source, 0, 2, document)
+		saved = io.BytesIO()
+		document.save(saved)
+
+		document = Document(saved)
+		self.assertEqual([paragraph.text for paragraph in document.paragraphs], ["Title", "P1", ""])
+		self.assertEqual(len(document.inline_shapes), 1)
+		self.assertEqual(get_docx_body_length(document), 3)
+
+	def test_html_byte_ranges(self):
+		portfolios = [make_portfolio("P1"), make_portfolio("P2"), make_portfolio("P3")]
+		context = RenderContext("kartoza", base_url="http://portfolio.test")
+		render = MagicMock(
+			side_effect=lambda layout, portfolio, *args, **kwargs: f"<section>{portfolio.name}</section>"
+		)
+
+		def export(name, previous=None):
+			path = os.path.join(self.folder, f"{name}.zip")
+			manifest = ExportManifest("html", "kartoza")
+			with patch("portfolio.export.iter_portfolios", return_value=iter(portfolios)), patch(
+				"portfolio.export.get_cached_fragment", render
+			), patch("portfolio.export.get_image_urls", return_value=[]):
+				export_html_bundle(
+					["P1", "P2", "P3"],
+					"kartoza",
+					path,
+					f"{name}.html",
+					manifest,
+					previous=previous,
+					resolver=LocalAssetResolver("http://portfolio.test"),
+					context=context,
+				)
+			with zipfile.ZipFile(path) as zip_file:
+				return path, manifest, zip_file.read(get_bundle_html_name(zip_file))
+
+		path, manifest, html = export("first")
+		for portfolio in portfolios:
+			start, stop = manifest.find(portfolio)
+			self.assertEqual(html[start:stop], f"<section>{portfolio.name}</section>".encode())
+
+		portfolios[1] = make_portfolio("P2", "2024-02-01 00:00:00")
+		render.reset_mock()
+		_path, spliced_manifest, spliced = export("second", make_previous(path, manifest))
+
+		self.assertEqual(spliced, html)
+		self.assertEqual([call.args[1].name for call in render.call_args_list], ["P2"])
+		self.assertEqual(
+			[portfolio[2:] for portfolio in spliced_manifest.portfolios],
+			[portfolio[2:] for portfolio in manifest.portfolios],
+		)